@@ -0,0 +1,584 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ssl
+import asyncio
+
+from io import BytesIO
+from urllib.parse import urlsplit, urlunsplit
+from http.client import HTTPMessage, HTTPException, parse_headers
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import h2.config
+    import h2.events
+    import h2.errors
+    import h2.exceptions
+    import h2.connection
+except ImportError:
+    h2 = None
+
+from pool import AsyncBody, AsyncConnectionPool
+from collapse import AsyncCollapser
+from certs import split_host
+from tunnel import split_target, splice
+from pyproxy import KEYFILE, CERTFILE, BLOCKSIZE, MAX_BLOCKSIZE, WRITE_BATCH, end_to_end
+
+ALPN = ('h2', 'http/1.1') if h2 is not None else ()
+CONNECTION_HEADERS = frozenset(('connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'))
+
+class Exchange():
+    def __init__(self, server, client_address, host=False):
+        self.server = server
+        self.client_address = client_address
+        self.host = host
+        self.command = None
+        self.path = None
+        self.request_version = None
+        self.headers = None
+        self.response = None
+
+def parse_request(head):
+    line, _, rest = head.partition(b'\r\n')
+    command, path, version = line.decode('iso-8859-1').split()
+    if not version.startswith('HTTP/'):
+        raise ValueError(version)
+    return command, path, version, parse_headers(BytesIO(rest))
+
+def wants_keep_alive(version, headers):
+    connection = ' '.join(headers.get_all('Connection', []) + headers.get_all('Proxy-Connection', [])).lower()
+    return version == 'HTTP/1.1' and 'close' not in connection
+
+class Http1Stream():
+    def __init__(self, writer, version='HTTP/1.1', keep_alive=False):
+        self.writer = writer
+        self.version = version
+        self.keep_alive = keep_alive
+        self.chunked = False
+    
+    async def proceed(self):
+        if self.version == 'HTTP/1.1':
+            self.writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await self.writer.drain()
+    
+    async def start(self, code, msg, headers, body=True):
+        if body and 'Content-Length' not in headers:
+            if self.version == 'HTTP/1.1':
+                headers['Transfer-Encoding'] = 'chunked'
+                self.chunked = True
+            else:
+                self.keep_alive = False
+        if not self.keep_alive:
+            headers['Connection'] = 'close'
+        lines = ['HTTP/1.1 {} {}\r\n'.format(code, msg)]
+        lines.extend('{}: {}\r\n'.format(keyword, value) for keyword, value in headers.items())
+        lines.append('\r\n')
+        self.writer.write(''.join(lines).encode('iso-8859-1', 'replace'))
+    
+    async def write(self, chunks):
+        if self.chunked:
+            chunks = [part for data in chunks if data for part in (b'%x\r\n' % len(data), data, b'\r\n')]
+        self.writer.writelines(chunks)
+    
+    async def drain(self):
+        await self.writer.drain()
+    
+    async def sendfile(self, file):
+        await self.writer.drain()
+        await asyncio.get_running_loop().sendfile(self.writer.transport, file)
+    
+    async def finish(self):
+        if self.chunked:
+            self.writer.write(b'0\r\n\r\n')
+        await self.writer.drain()
+
+class Http2Body():
+    def __init__(self, session, stream_id, length=None):
+        self.session = session
+        self.stream_id = stream_id
+        self.length = length
+        self.chunked = length is None
+        self.closed = False
+        self._buffer = bytearray()
+        self._ended = False
+        self._event = asyncio.Event()
+    
+    def feed(self, data, flow_controlled_length):
+        self._buffer += data
+        self.session.acknowledge(self.stream_id, flow_controlled_length - len(data))
+        self._event.set()
+    
+    def feed_eof(self):
+        self._ended = True
+        self._event.set()
+    
+    async def read(self, amt=None):
+        while not self._buffer and not self._ended:
+            self._event.clear()
+            await self._event.wait()
+        if amt is None:
+            amt = len(self._buffer)
+        data = bytes(self._buffer[:amt])
+        del self._buffer[:amt]
+        self.closed = self._ended and not self._buffer
+        self.session.acknowledge(self.stream_id, len(data))
+        return data
+    
+    def discard(self):
+        self.session.acknowledge(self.stream_id, len(self._buffer))
+        self._buffer.clear()
+    
+    def isclosed(self):
+        return self.closed
+
+class Http2Stream():
+    keep_alive = True
+    
+    def __init__(self, session, stream_id):
+        self.session = session
+        self.stream_id = stream_id
+    
+    async def proceed(self):
+        self.session.connection.send_headers(self.stream_id, ((':status', '100'),))
+        self.session.flush()
+        await self.session.writer.drain()
+    
+    async def start(self, code, msg, headers, body=True):
+        fields = [(':status', str(code))]
+        fields.extend((keyword.lower(), value) for keyword, value in headers.items()
+                      if keyword.lower() not in CONNECTION_HEADERS)
+        self.session.connection.send_headers(self.stream_id, fields)
+        self.session.flush()
+    
+    async def write(self, chunks):
+        for data in chunks:
+            if data:
+                await self.session.send_data(self.stream_id, data)
+    
+    async def drain(self):
+        await self.session.writer.drain()
+    
+    async def sendfile(self, file):
+        loop = asyncio.get_running_loop()
+        executor = self.session.proxy.executor
+        data = await loop.run_in_executor(executor, file.read, WRITE_BATCH)
+        while data:
+            await self.session.send_data(self.stream_id, data)
+            await self.session.writer.drain()
+            data = await loop.run_in_executor(executor, file.read, WRITE_BATCH)
+    
+    async def finish(self):
+        self.session.connection.end_stream(self.stream_id)
+        self.session.flush()
+        await self.session.writer.drain()
+
+class Http2Session():
+    def __init__(self, proxy, reader, writer, client_address, host):
+        self.proxy = proxy
+        self.reader = reader
+        self.writer = writer
+        self.client_address = client_address
+        self.host = host
+        config = h2.config.H2Configuration(client_side=False, header_encoding='utf-8')
+        self.connection = h2.connection.H2Connection(config)
+        self.bodies = {}
+        self.tasks = {}
+        self._windows = {}
+        self._terminated = False
+    
+    def flush(self):
+        data = self.connection.data_to_send()
+        if data:
+            self.writer.write(data)
+    
+    def acknowledge(self, stream_id, length):
+        if length > 0:
+            try:
+                self.connection.acknowledge_received_data(length, stream_id)
+            except h2.exceptions.StreamClosedError:
+                pass
+            self.flush()
+    
+    def wake(self, stream_id):
+        if stream_id:
+            event = self._windows.pop(stream_id, None)
+            if event is not None:
+                event.set()
+        else:
+            for event in self._windows.values():
+                event.set()
+            self._windows.clear()
+    
+    async def send_data(self, stream_id, data):
+        view = memoryview(data)
+        while view:
+            window = min(self.connection.local_flow_control_window(stream_id),
+                         self.connection.max_outbound_frame_size, len(view))
+            if window <= 0:
+                await self._windows.setdefault(stream_id, asyncio.Event()).wait()
+                continue
+            self.connection.send_data(stream_id, view[:window].tobytes())
+            self.flush()
+            view = view[window:]
+    
+    async def run(self):
+        self.connection.initiate_connection()
+        self.flush()
+        try:
+            while not self._terminated:
+                try:
+                    data = await asyncio.wait_for(self.reader.read(1 << 16),
+                                                  None if self.tasks else self.proxy.keep_alive)
+                except asyncio.TimeoutError:
+                    self.connection.close_connection()
+                    self.flush()
+                    break
+                if not data:
+                    break
+                try:
+                    events = self.connection.receive_data(data)
+                except h2.exceptions.ProtocolError:
+                    self.flush()
+                    break
+                for event in events:
+                    self.dispatch(event)
+                self.flush()
+        finally:
+            tasks = list(self.tasks.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def dispatch(self, event):
+        if isinstance(event, h2.events.RequestReceived):
+            self.request(event)
+        elif isinstance(event, h2.events.DataReceived):
+            body = self.bodies.get(event.stream_id)
+            if body is not None:
+                body.feed(event.data, event.flow_controlled_length)
+            else:
+                self.acknowledge(event.stream_id, event.flow_controlled_length)
+        elif isinstance(event, h2.events.StreamEnded):
+            body = self.bodies.get(event.stream_id)
+            if body is not None:
+                body.feed_eof()
+        elif isinstance(event, h2.events.StreamReset):
+            task = self.tasks.get(event.stream_id)
+            if task is not None:
+                task.cancel()
+            self.wake(event.stream_id)
+        elif isinstance(event, h2.events.WindowUpdated):
+            self.wake(event.stream_id)
+        elif isinstance(event, h2.events.RemoteSettingsChanged):
+            self.wake(0)
+        elif isinstance(event, h2.events.ConnectionTerminated):
+            self._terminated = True
+    
+    def request(self, event):
+        handler = Exchange(self.proxy, self.client_address, self.host)
+        handler.request_version = 'HTTP/2.0'
+        handler.headers = HTTPMessage()
+        cookies = []
+        for keyword, value in event.headers:
+            if keyword == ':method':
+                handler.command = value
+            elif keyword == ':path':
+                handler.path = value
+            elif keyword == ':authority':
+                handler.headers['Host'] = value
+            elif keyword == 'cookie':
+                cookies.append(value)
+            elif not keyword.startswith(':'):
+                handler.headers[keyword] = value
+        if cookies:
+            handler.headers['Cookie'] = '; '.join(cookies)
+        body = None
+        if event.stream_ended is None:
+            length = handler.headers.get('Content-Length')
+            body = Http2Body(self, event.stream_id, int(length) if length else None)
+            self.bodies[event.stream_id] = body
+        task = asyncio.ensure_future(self.respond(event.stream_id, handler, body))
+        self.tasks[event.stream_id] = task
+        task.add_done_callback(lambda task: self.tasks.pop(event.stream_id, None))
+    
+    async def respond(self, stream_id, handler, body):
+        try:
+            await self.proxy.proxy(handler, body, Http2Stream(self, stream_id))
+            if body is not None and not body.isclosed():
+                self.connection.reset_stream(stream_id, h2.errors.ErrorCodes.NO_ERROR)
+        except Exception:
+            try:
+                self.connection.reset_stream(stream_id, h2.errors.ErrorCodes.INTERNAL_ERROR)
+            except h2.exceptions.ProtocolError:
+                pass
+        finally:
+            body = self.bodies.pop(stream_id, None)
+            if body is not None:
+                body.discard()
+            self.flush()
+
+class AsyncProxy():
+    def __init__(self, manipulator, host='127.0.0.1', port=8080, workers=16, keep_alive=75, backlog=1024,
+                 pool=None, authority=None, collapse=False):
+        self.manipulator = manipulator
+        self.host = host
+        self.port = port
+        self.keep_alive = keep_alive
+        self.backlog = backlog
+        self.executor = ThreadPoolExecutor(workers)
+        self.pool = AsyncConnectionPool() if pool is None else pool
+        if collapse:
+            self.pool = AsyncCollapser(self.pool)
+        self.authority = authority
+        self.server = None
+        self._context = None
+    
+    @property
+    def context(self):
+        if self._context is None:
+            self._context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self._context.load_cert_chain(CERTFILE, KEYFILE)
+            if ALPN:
+                self._context.set_alpn_protocols(ALPN)
+        return self._context
+    
+    async def server_context(self, target):
+        if self.authority is None:
+            return self.context
+        context = self.authority.cached(target, ALPN)
+        if context is None:
+            loop = asyncio.get_running_loop()
+            context = await loop.run_in_executor(self.executor, self.authority.context, target, ALPN)
+        return context
+    
+    def manipulate(self, function, value, handler):
+        return self.manipulator.manipulate_async(function, value, handler, self.executor)
+    
+    async def start(self):
+        self.server = await asyncio.start_server(self.connection, self.host, self.port, backlog=self.backlog)
+    
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+    
+    async def connection(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        host = False
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keep_alive)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                try:
+                    command, path, version, headers = parse_request(head)
+                except (ValueError, HTTPException):
+                    await self.send_error(Http1Stream(writer), 400, 'Bad Request')
+                    break
+                if command == 'CONNECT':
+                    if not self.manipulator.intercepts(split_host(headers.get('Host', path))):
+                        await self.tunnel(path, reader, writer)
+                        break
+                    host = headers.get('Host', path)
+                    try:
+                        context = await self.server_context(host)
+                    except (ValueError, OSError):
+                        await self.send_error(Http1Stream(writer), 502, 'Bad Gateway')
+                        break
+                    writer.write(b'HTTP/1.1 200 Connection established\r\n\r\n')
+                    await writer.drain()
+                    await writer.start_tls(context)
+                    if writer.get_extra_info('ssl_object').selected_alpn_protocol() == 'h2':
+                        await Http2Session(self, reader, writer, client_address, host).run()
+                        break
+                    continue
+                handler = Exchange(self, client_address, host)
+                handler.command, handler.path, handler.request_version = command, path, version
+                handler.headers = headers
+                try:
+                    body = AsyncBody.from_headers(reader, headers)
+                except ValueError:
+                    await self.send_error(Http1Stream(writer), 400, 'Bad Content-Length')
+                    break
+                stream = Http1Stream(writer, version, wants_keep_alive(version, headers))
+                await self.proxy(handler, body, stream)
+                if not stream.keep_alive or not (body is None or body.isclosed()):
+                    break
+        except (ConnectionError, ssl.SSLError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+    
+    async def tunnel(self, target, reader, writer):
+        try:
+            upstream_reader, upstream_writer = await asyncio.wait_for(
+                asyncio.open_connection(*split_target(target)), self.pool.timeout)
+        except (OSError, ValueError) as error:
+            await self.send_error(Http1Stream(writer), 502, str(error) or 'Bad Gateway')
+            return
+        writer.write(b'HTTP/1.1 200 Connection established\r\n\r\n')
+        await splice(reader, writer, upstream_reader, upstream_writer)
+    
+    async def proxy(self, handler, body, stream):
+        await self.manipulate('started', None, handler)
+        try:
+            await self.forward(handler, body, stream)
+        finally:
+            await self.manipulate('finished', None, handler)
+    
+    async def forward(self, handler, body, stream):
+        if handler.host:
+            handler.path = 'https://{host}{path}'.format(host=handler.host, path=handler.path)
+        handler.path = await self.manipulate('request_path', handler.path, handler)
+        handler.headers = await self.manipulate('request_headers', handler.headers, handler)
+        post_data = None
+        if body is not None:
+            continuing = '100-continue' in handler.headers.get('Expect', '').lower()
+            post_data = self.stream_body(body, handler, stream if continuing else None)
+        hit = await self.manipulate('cached', None, handler)
+        if hit is not None:
+            await self.send_cached(stream, hit, handler)
+            return
+        headers = end_to_end(handler.headers)
+        if body is not None and (body.chunked or self.manipulator.implements('request_data')):
+            del headers['Content-Length']
+        url = urlsplit(handler.path)
+        target = urlunsplit(('', '', url.path or '/', url.query, ''))
+        try:
+            connection, response = await self.pool.request(url.scheme, url.hostname, url.port, handler.command,
+                                                            target, post_data, headers, post_data is None)
+        except ValueError:
+            stream.keep_alive = False
+            await self.send_error(stream, 400, 'Malformed request body')
+            return
+        except (OSError, HTTPException, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as error:
+            await self.send_error(stream, 502, str(error) or 'Bad Gateway')
+            return
+        try:
+            handler.response = response
+            hit = await self.manipulate('cached', None, handler)
+            if hit is not None:
+                await response.read()
+            else:
+                await self.relay(handler, response, stream)
+        except BaseException:
+            connection.close()
+            raise
+        if response.will_close or not response.isclosed():
+            connection.close()
+        else:
+            self.pool.release(connection)
+        if hit is not None:
+            await self.send_cached(stream, hit, handler)
+    
+    async def stream_body(self, body, handler, stream=None):
+        if stream is not None:
+            await stream.proceed()
+        data = await self.read_body(body)
+        while data:
+            data = await self.manipulate('request_data', data, handler)
+            if data:
+                yield data
+            data = await self.read_body(body)
+        data = await self.manipulate('request_end', b'', handler)
+        if data:
+            yield data
+    
+    async def read_body(self, body):
+        try:
+            return await body.read(BLOCKSIZE)
+        except HTTPException as error:
+            raise ValueError('malformed request body') from error
+    
+    async def relay(self, handler, response, stream):
+        if response.status >= 400:
+            code = await self.manipulate('error_code', response.status, handler)
+            msg = await self.manipulate('error_msg', response.reason, handler)
+            headers = await self.manipulate('error_headers', end_to_end(response.msg), handler)
+        else:
+            code, msg = response.status, response.reason
+            headers = await self.manipulate('response_headers', end_to_end(response.msg), handler)
+        filtered = self.manipulator.filters(handler)
+        if filtered and not response.isclosed():
+            del headers['Content-Length']
+        await stream.start(code, msg, headers, not response.isclosed())
+        blocksize = await self.manipulate('blocksize', BLOCKSIZE, handler)
+        if filtered or not blocksize:
+            await self.filter(handler, response, stream, blocksize)
+        else:
+            await self.copy(response, stream)
+        await stream.write((await self.manipulate('response_end', b'', handler),))
+        await stream.finish()
+    
+    async def filter(self, handler, response, stream, blocksize):
+        batch, batched = [], 0
+        data = await response.read(blocksize or None)
+        while data:
+            filled = len(data) == blocksize
+            data = await self.manipulate('response_data', data, handler)
+            if data:
+                batch.append(data)
+                batched += len(data)
+            if batched >= WRITE_BATCH or not filled:
+                await stream.write(batch)
+                await stream.drain()
+                batch, batched = [], 0
+            if blocksize and filled:
+                blocksize = min(blocksize * 2, MAX_BLOCKSIZE)
+            data = await response.read(blocksize or None)
+        await stream.write(batch)
+    
+    async def copy(self, response, stream):
+        data = await response.read(MAX_BLOCKSIZE)
+        while data:
+            await stream.write((data,))
+            await stream.drain()
+            data = await response.read(MAX_BLOCKSIZE)
+    
+    async def send_cached(self, stream, hit, handler):
+        try:
+            await stream.start(hit.status, hit.reason, hit.headers, False)
+            if hit.file is not None and handler.command != 'HEAD':
+                await stream.sendfile(hit.file)
+            await stream.finish()
+        finally:
+            if hit.file is not None:
+                hit.file.close()
+    
+    async def send_error(self, stream, code, msg):
+        body = msg.encode('utf-8', 'replace')
+        headers = HTTPMessage()
+        headers['Content-Type'] = 'text/plain; charset=utf-8'
+        headers['Content-Length'] = str(len(body))
+        await stream.start(code, msg.splitlines()[0], headers, False)
+        await stream.write((body,))
+        await stream.finish()
+    
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.pool.close()
+        self.executor.shutdown(wait=False)
+
+def serve(manipulator, host='127.0.0.1', port=8080, **options):
+    proxy = AsyncProxy(manipulator, host, port, **options)
+    try:
+        asyncio.run(proxy.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.close()
@@ -0,0 +1,146 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import ssl
+import time
+import random
+import tempfile
+import ipaddress
+import threading
+import subprocess
+
+from collections import OrderedDict
+
+HOSTNAME = re.compile(r'^[A-Za-z0-9_-]+(\.[A-Za-z0-9_-]+)*\.?$')
+CURVE = 'prime256v1'
+RENEW = 86400
+
+def split_host(target):
+    if target.startswith('['):
+        return target[1:target.index(']')]
+    return target.rsplit(':', 1)[0] if target.count(':') == 1 else target
+
+class CertificateAuthority():
+    def __init__(self, directory='certs', days=365, cache_size=1024, subject='/CN=pyproxy CA'):
+        self.directory = directory
+        self.days = days
+        self.cache_size = cache_size
+        self.subject = subject
+        self.ca_key = os.path.join(directory, 'ca.key')
+        self.ca_cert = os.path.join(directory, 'ca.crt')
+        self.leaf_key = os.path.join(directory, 'leaf.key')
+        self.hosts = os.path.join(directory, 'hosts')
+        self.renew = min(RENEW, days * 43200)
+        self.minted = 0
+        self._contexts = OrderedDict()
+        self._lock = threading.Lock()
+        self._locks = {}
+    
+    def openssl(self, *arguments, data=None):
+        process = subprocess.run(('openssl',) + arguments, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if process.returncode:
+            raise OSError('openssl {}: {}'.format(arguments[0], process.stderr.decode('utf-8', 'replace').strip()))
+        return process.stdout
+    
+    def setup(self):
+        os.makedirs(self.hosts, exist_ok=True)
+        fresh = not os.path.exists(self.ca_key) or not os.path.exists(self.ca_cert)
+        if fresh:
+            self.openssl('ecparam', '-name', CURVE, '-genkey', '-noout', '-out', self.ca_key)
+            with tempfile.NamedTemporaryFile('w', suffix='.cnf') as extensions:
+                extensions.write('[req]\ndistinguished_name=dn\n[dn]\n[ca]\n'
+                                 'basicConstraints=critical,CA:TRUE\n'
+                                 'keyUsage=critical,keyCertSign,cRLSign\n'
+                                 'subjectKeyIdentifier=hash\n')
+                extensions.flush()
+                self.openssl('req', '-new', '-x509', '-sha256', '-days', str(self.days * 10), '-key', self.ca_key,
+                             '-subj', self.subject, '-config', extensions.name, '-extensions', 'ca',
+                             '-out', self.ca_cert)
+        if not os.path.exists(self.leaf_key):
+            self.openssl('ecparam', '-name', CURVE, '-genkey', '-noout', '-out', self.leaf_key)
+            fresh = True
+        if fresh:
+            for name in os.listdir(self.hosts):
+                os.unlink(os.path.join(self.hosts, name))
+            with self._lock:
+                self._contexts.clear()
+    
+    def current(self, path):
+        try:
+            self.openssl('verify', '-CAfile', self.ca_cert, '-attime', str(int(time.time()) + self.renew), path)
+        except OSError:
+            return False
+        return True
+    
+    def certificate(self, host):
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            address = None
+            if not HOSTNAME.match(host) or len(host) > 253:
+                raise ValueError('invalid hostname {!r}'.format(host))
+        path = os.path.join(self.hosts, host.replace(':', '_') + '.crt')
+        if os.path.exists(path) and self.current(path):
+            return path
+        request = self.openssl('req', '-new', '-key', self.leaf_key, '-subj', '/CN={}'.format(host[:64]))
+        with tempfile.NamedTemporaryFile('w', suffix='.cnf') as extensions:
+            extensions.write('subjectAltName={}:{}\nbasicConstraints=CA:FALSE\n'
+                             'keyUsage=critical,digitalSignature\nextendedKeyUsage=serverAuth\n'
+                             .format('DNS' if address is None else 'IP', host))
+            extensions.flush()
+            certificate = self.openssl('x509', '-req', '-sha256', '-days', str(self.days), '-CA', self.ca_cert,
+                                       '-CAkey', self.ca_key, '-set_serial', str(random.getrandbits(63)),
+                                       '-extfile', extensions.name, data=request)
+        temporary = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temporary, 'wb') as file:
+            file.write(certificate)
+        os.replace(temporary, path)
+        self.minted += 1
+        return path
+    
+    def cached(self, target, alpn=()):
+        key = split_host(target).lower(), tuple(alpn)
+        with self._lock:
+            if key in self._contexts:
+                context, created = self._contexts[key]
+                if time.monotonic() - created < self.renew:
+                    self._contexts.move_to_end(key)
+                    return context
+                del self._contexts[key]
+    
+    def context(self, target, alpn=()):
+        context = self.cached(target, alpn)
+        if context is not None:
+            return context
+        host = split_host(target).lower()
+        with self._lock:
+            lock = self._locks.setdefault(host, threading.Lock())
+        with lock:
+            context = self.cached(target, alpn)
+            if context is None:
+                context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+                context.options &= ~ssl.OP_NO_TICKET
+                context.load_cert_chain(self.certificate(host), self.leaf_key)
+                if alpn:
+                    context.set_alpn_protocols(alpn)
+                with self._lock:
+                    self._contexts[host, tuple(alpn)] = context, time.monotonic()
+                    while len(self._contexts) > self.cache_size:
+                        self._contexts.popitem(last=False)
+        with self._lock:
+            self._locks.pop(host, None)
+        return context
@@ -0,0 +1,401 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import tempfile
+import threading
+
+from collections import deque
+
+KEYED = ('Accept-Encoding', 'Accept-Language', 'Authorization', 'Cookie', 'If-None-Match', 'If-Modified-Since')
+BLOCKSIZE = 65536
+BUFFER_SIZE = 1 << 20
+
+def collapse_key(scheme, host, port, method, target, body, headers):
+    if method != 'GET' or body or headers is None or 'Range' in headers:
+        return None
+    return (scheme, host, port, target) + tuple(headers.get(name) for name in KEYED)
+
+class Spool():
+    def __init__(self, limit):
+        self.limit = limit
+        self._chunks = deque()
+        self._size = 0
+        self._file = None
+        self._written = 0
+        self._read = 0
+    
+    def __len__(self):
+        return self._size + self._written - self._read
+    
+    def put(self, data):
+        if self._file is None and self._size + len(data) <= self.limit:
+            self._chunks.append(data)
+            self._size += len(data)
+            return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+            self._written = self._read = 0
+        self._file.seek(self._written)
+        self._file.write(data)
+        self._written += len(data)
+    
+    def get(self, amt):
+        if self._chunks:
+            data = self._chunks.popleft()
+            if len(data) > amt:
+                self._chunks.appendleft(data[amt:])
+                data = data[:amt]
+            self._size -= len(data)
+            return data
+        if self._file is not None:
+            self._file.seek(self._read)
+            data = self._file.read(min(amt, self._written - self._read))
+            self._read += len(data)
+            if self._read == self._written:
+                self.close()
+            return data
+        return b''
+    
+    def close(self):
+        self._chunks.clear()
+        self._size = 0
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class Flight():
+    def __init__(self, collapser, key, headers):
+        self.collapser = collapser
+        self.key = key
+        self.headers = headers
+        self.response = None
+        self.error = None
+        self.done = False
+        self.joinable = True
+        self.subscribers = []
+        self._prefix = []
+        self._prefix_size = 0
+    
+    def shareable(self, headers):
+        msg = self.response.msg
+        directives = msg.get('Cache-Control', '').lower()
+        if 'Set-Cookie' in msg or 'private' in directives or 'no-store' in directives:
+            return False
+        for value in msg.get_all('Vary', []):
+            for name in value.split(','):
+                name = name.strip()
+                if name == '*' or (name and self.headers.get(name) != headers.get(name)):
+                    return False
+        return True
+    
+    def attach(self, subscription):
+        if not self.joinable:
+            return None
+        for data in self._prefix:
+            subscription.spool.put(data)
+        self.subscribers.append(subscription)
+        return subscription
+    
+    def detach(self, subscription):
+        if subscription in self.subscribers:
+            self.subscribers.remove(subscription)
+        subscription.spool.close()
+    
+    def put(self, data):
+        for subscription in self.subscribers:
+            subscription.spool.put(data)
+        if self.joinable:
+            self._prefix.append(data)
+            self._prefix_size += len(data)
+            if self._prefix_size > self.collapser.buffer_size:
+                self.joinable = False
+                self._prefix = []
+        return self.joinable
+    
+    def close(self, error=None):
+        self.done = True
+        self.error = error
+        self.joinable = False
+        self._prefix = []
+
+class Subscription():
+    will_close = False
+    
+    def __init__(self, flight):
+        self.flight = flight
+        self.spool = Spool(flight.collapser.buffer_size)
+    
+    @property
+    def status(self):
+        return self.flight.response.status
+    
+    @property
+    def reason(self):
+        return self.flight.response.reason
+    
+    @property
+    def msg(self):
+        return self.flight.response.msg
+    
+    def isclosed(self):
+        return self.flight.done and self.flight.error is None and not self.spool
+
+class SyncFlight(Flight):
+    def __init__(self, collapser, key, headers):
+        super().__init__(collapser, key, headers)
+        self.condition = threading.Condition()
+    
+    def subscribe(self):
+        with self.condition:
+            return self.attach(SyncSubscription(self))
+    
+    def unsubscribe(self, subscription):
+        with self.condition:
+            self.detach(subscription)
+    
+    def run(self, scheme, host, port, method, target, headers, retry):
+        try:
+            connection, response = self.collapser.pool.request(scheme, host, port, method, target, None, headers,
+                                                               retry)
+        except Exception as error:
+            self.finish(error)
+            return
+        with self.condition:
+            self.response = response
+            self.condition.notify_all()
+        try:
+            data = response.read(self.collapser.blocksize)
+            while data and self.subscribers:
+                with self.condition:
+                    joinable = self.put(data)
+                    self.condition.notify_all()
+                if not joinable:
+                    self.collapser.forget(self)
+                data = response.read(self.collapser.blocksize)
+        except Exception as error:
+            connection.close()
+            self.finish(error)
+            return
+        if response.will_close or not response.isclosed():
+            connection.close()
+        else:
+            self.collapser.pool.release(connection)
+        self.finish()
+    
+    def finish(self, error=None):
+        with self.condition:
+            self.close(error)
+            self.condition.notify_all()
+        self.collapser.forget(self)
+
+class SyncSubscription(Subscription):
+    def wait(self):
+        with self.flight.condition:
+            while self.flight.response is None and not self.flight.done:
+                self.flight.condition.wait()
+        if self.flight.response is None:
+            raise self.flight.error
+    
+    def read(self, amt=None):
+        if amt is None:
+            return b''.join(iter(lambda: self.read(BLOCKSIZE), b''))
+        with self.flight.condition:
+            while True:
+                data = self.spool.get(amt)
+                if data:
+                    return data
+                if self.flight.done:
+                    if self.flight.error is not None:
+                        raise self.flight.error
+                    return b''
+                self.flight.condition.wait()
+    
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+    
+    def close(self):
+        self.flight.unsubscribe(self)
+
+class Collapser():
+    def __init__(self, pool, buffer_size=BUFFER_SIZE, blocksize=BLOCKSIZE):
+        self.pool = pool
+        self.buffer_size = buffer_size
+        self.blocksize = blocksize
+        self.flights = 0
+        self.collapsed = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+    
+    def join(self, key, headers):
+        with self._lock:
+            flight = self._flights.get(key)
+            subscription = None if flight is None else flight.subscribe()
+            if subscription is not None:
+                self.collapsed += 1
+                return flight, subscription, False
+            flight = self._flights[key] = SyncFlight(self, key, headers)
+            self.flights += 1
+            return flight, flight.subscribe(), True
+    
+    def forget(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+    
+    def request(self, scheme, host, port, method, target, body=None, headers=None, retry=True):
+        key = collapse_key(scheme, host, port, method, target, body, headers)
+        if key is None:
+            return self.pool.request(scheme, host, port, method, target, body, headers, retry)
+        flight, subscription, leader = self.join(key, headers)
+        if leader:
+            threading.Thread(target=flight.run, args=(scheme, host, port, method, target, headers, retry),
+                             daemon=True).start()
+        subscription.wait()
+        if not leader and not flight.shareable(headers):
+            subscription.close()
+            return self.pool.request(scheme, host, port, method, target, body, headers, retry)
+        return subscription, subscription
+    
+    def release(self, connection):
+        if isinstance(connection, Subscription):
+            connection.close()
+        else:
+            self.pool.release(connection)
+    
+    @property
+    def timeout(self):
+        return self.pool.timeout
+    
+    def close(self):
+        self.pool.close()
+
+class AsyncFlight(Flight):
+    def subscribe(self):
+        return self.attach(AsyncSubscription(self))
+    
+    def unsubscribe(self, subscription):
+        self.detach(subscription)
+    
+    def wake(self):
+        for subscription in self.subscribers:
+            subscription.ready.set()
+    
+    async def run(self, scheme, host, port, method, target, headers, retry):
+        try:
+            connection, response = await self.collapser.pool.request(scheme, host, port, method, target, None,
+                                                                     headers, retry)
+        except Exception as error:
+            self.finish(error)
+            return
+        self.response = response
+        self.wake()
+        try:
+            data = await response.read(self.collapser.blocksize)
+            while data and self.subscribers:
+                if not self.put(data):
+                    self.collapser.forget(self)
+                self.wake()
+                data = await response.read(self.collapser.blocksize)
+        except BaseException as error:
+            connection.close()
+            self.finish(error)
+            if not isinstance(error, Exception):
+                raise
+            return
+        if response.will_close or not response.isclosed():
+            connection.close()
+        else:
+            self.collapser.pool.release(connection)
+        self.finish()
+    
+    def finish(self, error=None):
+        self.close(error)
+        self.wake()
+        self.collapser.forget(self)
+
+class AsyncSubscription(Subscription):
+    def __init__(self, flight):
+        super().__init__(flight)
+        self.ready = asyncio.Event()
+    
+    async def wait(self):
+        while self.flight.response is None and not self.flight.done:
+            self.ready.clear()
+            await self.ready.wait()
+        if self.flight.response is None:
+            raise self.flight.error
+    
+    async def read(self, amt=None):
+        if amt is None:
+            chunks = []
+            data = await self.read(BLOCKSIZE)
+            while data:
+                chunks.append(data)
+                data = await self.read(BLOCKSIZE)
+            return b''.join(chunks)
+        while True:
+            data = self.spool.get(amt)
+            if data:
+                return data
+            if self.flight.done:
+                if self.flight.error is not None:
+                    raise self.flight.error
+                return b''
+            self.ready.clear()
+            await self.ready.wait()
+    
+    def close(self):
+        self.flight.unsubscribe(self)
+
+class AsyncCollapser(Collapser):
+    def __init__(self, pool, buffer_size=BUFFER_SIZE, blocksize=BLOCKSIZE):
+        super().__init__(pool, buffer_size, blocksize)
+        self._tasks = set()
+    
+    def join(self, key, headers):
+        flight = self._flights.get(key)
+        subscription = None if flight is None else flight.subscribe()
+        if subscription is not None:
+            self.collapsed += 1
+            return flight, subscription, False
+        flight = self._flights[key] = AsyncFlight(self, key, headers)
+        self.flights += 1
+        return flight, flight.subscribe(), True
+    
+    def forget(self, flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+    
+    async def request(self, scheme, host, port, method, target, body=None, headers=None, retry=True):
+        key = collapse_key(scheme, host, port, method, target, body, headers)
+        if key is None:
+            return await self.pool.request(scheme, host, port, method, target, body, headers, retry)
+        flight, subscription, leader = self.join(key, headers)
+        if leader:
+            task = asyncio.ensure_future(flight.run(scheme, host, port, method, target, headers, retry))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        try:
+            await subscription.wait()
+        except BaseException:
+            subscription.close()
+            raise
+        if not leader and not flight.shareable(headers):
+            subscription.close()
+            return await self.pool.request(scheme, host, port, method, target, body, headers, retry)
+        return subscription, subscription
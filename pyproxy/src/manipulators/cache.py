@@ -0,0 +1,411 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from http.client import HTTPMessage
+
+CACHEABLE = (200, 203, 300, 301, 308, 404, 410)
+UNSAFE = ('POST', 'PUT', 'DELETE', 'PATCH')
+UPDATE_EXCLUDE = ('content-length', 'content-encoding', 'transfer-encoding', 'content-range')
+HEURISTIC = 0.1
+MAX_HEURISTIC = 86400
+
+def cache_control(headers):
+    directives = {}
+    for value in headers.get_all('Cache-Control', []):
+        for directive in value.split(','):
+            name, _, argument = directive.strip().partition('=')
+            if name:
+                directives[name.lower()] = argument.strip().strip('"')
+    if not directives and 'no-cache' in headers.get('Pragma', '').lower():
+        directives['no-cache'] = ''
+    return directives
+
+def seconds(value, default=None):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return default
+
+def timestamp(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def etags(value):
+    return [tag.strip().lstrip('W/') for tag in value.split(',')]
+
+class Hit():
+    def __init__(self, status, reason, headers, file=None):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.file = file
+
+class Entry():
+    def __init__(self, status, reason, headers, vary, digest, size, request_time, response_time):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.vary = vary
+        self.digest = digest
+        self.size = size
+        self.request_time = request_time
+        self.response_time = response_time
+    
+    @classmethod
+    def load(cls, data):
+        return cls(data['status'], data['reason'], [tuple(header) for header in data['headers']], data['vary'],
+                   data['digest'], data['size'], data['request_time'], data['response_time'])
+    
+    def dump(self):
+        return {'status': self.status, 'reason': self.reason, 'headers': self.headers, 'vary': self.vary,
+                'digest': self.digest, 'size': self.size, 'request_time': self.request_time,
+                'response_time': self.response_time}
+    
+    def message(self):
+        message = HTTPMessage()
+        for keyword, value in self.headers:
+            message[keyword] = value
+        return message
+    
+    def matches(self, headers):
+        return all(headers.get(name) == value for name, value in self.vary.items())
+    
+    def age(self, now):
+        headers = self.message()
+        date = timestamp(headers.get('Date')) or self.response_time
+        apparent = max(0, self.response_time - date)
+        corrected = seconds(headers.get('Age'), 0) + self.response_time - self.request_time
+        return max(apparent, corrected) + now - self.response_time
+    
+    def lifetime(self, shared=True):
+        headers = self.message()
+        directives = cache_control(headers)
+        if shared and seconds(directives.get('s-maxage')) is not None:
+            return seconds(directives['s-maxage'])
+        if seconds(directives.get('max-age')) is not None:
+            return seconds(directives['max-age'])
+        date = timestamp(headers.get('Date')) or self.response_time
+        if 'Expires' in headers:
+            expires = timestamp(headers['Expires'])
+            return max(0, expires - date) if expires is not None else 0
+        modified = timestamp(headers.get('Last-Modified'))
+        if modified is not None and self.status in CACHEABLE:
+            return min(MAX_HEURISTIC, max(0, date - modified) * HEURISTIC)
+        return 0
+
+class Pending():
+    def __init__(self, directory, key, entry):
+        self.key = key
+        self.entry = entry
+        self.file = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.complete = False
+    
+    def write(self, data):
+        self.file.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+    
+    def discard(self):
+        self.file.close()
+        try:
+            os.unlink(self.file.name)
+        except OSError:
+            pass
+
+class Cache():
+    priority = -10
+    def __init__(self, directory='cache', max_size=1 << 30, max_object=64 << 20, shared=True, hosts=()):
+        self.directory = directory
+        self.hosts = hosts
+        self.max_size = max_size
+        self.max_object = max_object
+        self.shared = shared
+        self.objects = os.path.join(directory, 'objects')
+        self.meta = os.path.join(directory, 'meta')
+        self.tmp = os.path.join(directory, 'tmp')
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.stored = 0
+        self.evictions = 0
+        self._objects = OrderedDict()
+        self._references = {}
+        self._pending = {}
+        self._revalidating = {}
+        self._lock = threading.RLock()
+        self.scan()
+    
+    def scan(self):
+        for directory in (self.objects, self.meta, self.tmp):
+            os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(self.tmp):
+            os.unlink(os.path.join(self.tmp, name))
+        objects = []
+        for root, directories, files in os.walk(self.objects):
+            for name in files:
+                stat = os.stat(os.path.join(root, name))
+                objects.append((stat.st_mtime, os.path.basename(root) + name, stat.st_size))
+        for mtime, digest, size in sorted(objects):
+            self._objects[digest] = size
+            self.size += size
+        for name in os.listdir(self.meta):
+            path = os.path.join(self.meta, name)
+            if name.endswith('.tmp'):
+                os.unlink(path)
+                continue
+            self.store(path, [entry for entry in self.load(path) if entry.digest in self._objects])
+        self.evict()
+    
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest[2:])
+    
+    def meta_path(self, key):
+        return os.path.join(self.meta, hashlib.sha256(key.encode('utf-8')).hexdigest())
+    
+    def load(self, path):
+        try:
+            with open(path, 'r') as file:
+                return [Entry.load(data) for data in json.load(file)]
+        except (OSError, ValueError, KeyError):
+            return []
+    
+    def store(self, path, variants):
+        if not variants:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return
+        temporary = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temporary, 'w') as file:
+            json.dump([entry.dump() for entry in variants], file)
+        os.replace(temporary, path)
+        with self._lock:
+            for entry in variants:
+                self._references.setdefault(entry.digest, set()).add(path)
+    
+    def variants(self, key):
+        return self.load(self.meta_path(key))
+    
+    def save(self, key, variants):
+        self.store(self.meta_path(key), variants)
+    
+    def invalidate(self, key):
+        self.store(self.meta_path(key), [])
+    
+    def open(self, digest):
+        with self._lock:
+            try:
+                file = open(self.object_path(digest), 'rb')
+            except OSError:
+                return None
+            if digest in self._objects:
+                self._objects.move_to_end(digest)
+            return file
+    
+    def evict(self):
+        with self._lock:
+            while self.size > self.max_size and self._objects:
+                digest, size = self._objects.popitem(last=False)
+                try:
+                    os.unlink(self.object_path(digest))
+                except OSError:
+                    pass
+                for path in self._references.pop(digest, ()):
+                    self.store(path, [entry for entry in self.load(path) if entry.digest != digest])
+                self.size -= size
+                self.evictions += 1
+    
+    def find(self, key, headers):
+        with self._lock:
+            for entry in self.variants(key):
+                if entry.matches(headers):
+                    return entry
+    
+    def hit(self, entry, age, file, handler):
+        headers = entry.message()
+        del headers['Age']
+        headers['Age'] = str(int(age))
+        validators = 'ETag' in headers or 'Last-Modified' in headers
+        if 'If-None-Match' in handler.headers:
+            matched = '*' in etags(handler.headers['If-None-Match']) or (
+                'ETag' in headers and etags(headers['ETag'])[0] in etags(handler.headers['If-None-Match']))
+        else:
+            since = timestamp(handler.headers.get('If-Modified-Since'))
+            modified = timestamp(headers.get('Last-Modified'))
+            matched = since is not None and modified is not None and modified <= since
+        if validators and matched and entry.status == 200:
+            file.close()
+            return Hit(304, 'Not Modified', headers)
+        return Hit(entry.status, entry.reason, headers, file)
+    
+    def cached(self, none, handler):
+        if handler.response is None:
+            return self.lookup(handler)
+        return self.update(handler.response, handler)
+    
+    def lookup(self, handler):
+        if handler.command not in ('GET', 'HEAD') or 'Range' in handler.headers:
+            return None
+        request = cache_control(handler.headers)
+        entry = self.find(handler.path, handler.headers)
+        if entry is None:
+            self.misses += 1
+            if 'only-if-cached' in request:
+                headers = HTTPMessage()
+                headers['Content-Length'] = '0'
+                return Hit(504, 'Gateway Timeout', headers)
+            return None
+        now = time.time()
+        age = entry.age(now)
+        lifetime = entry.lifetime(self.shared)
+        directives = cache_control(entry.message())
+        fresh = age < lifetime and 'no-cache' not in request and 'no-cache' not in directives
+        if seconds(request.get('max-age')) is not None:
+            fresh = fresh and age <= seconds(request['max-age'])
+        if seconds(request.get('min-fresh')) is not None:
+            fresh = fresh and lifetime - age >= seconds(request['min-fresh'])
+        file = self.open(entry.digest)
+        if file is None:
+            self.misses += 1
+            return None
+        if fresh:
+            self.hits += 1
+            return self.hit(entry, age, file, handler)
+        headers = entry.message()
+        conditional = any(name in handler.headers for name in ('If-None-Match', 'If-Modified-Since',
+                                                                'If-Match', 'If-Unmodified-Since'))
+        if handler.command == 'GET' and not conditional and ('ETag' in headers or 'Last-Modified' in headers):
+            if 'ETag' in headers:
+                handler.headers['If-None-Match'] = headers['ETag']
+            if 'Last-Modified' in headers:
+                handler.headers['If-Modified-Since'] = headers['Last-Modified']
+            self._revalidating[handler] = (entry, file, now)
+            return None
+        file.close()
+        self.misses += 1
+        return None
+    
+    def update(self, response, handler):
+        key = handler.path
+        revalidating = self._revalidating.pop(handler, None)
+        if handler.command in UNSAFE and response.status < 400:
+            with self._lock:
+                self.invalidate(key)
+        if revalidating is not None:
+            entry, file, request_time = revalidating
+            del handler.headers['If-None-Match']
+            del handler.headers['If-Modified-Since']
+            if response.status == 304:
+                headers = [(keyword, value) for keyword, value in entry.headers
+                           if keyword.lower() not in response.msg or keyword.lower() in UPDATE_EXCLUDE]
+                headers.extend((keyword, value) for keyword, value in response.msg.items()
+                               if keyword.lower() not in UPDATE_EXCLUDE and keyword.lower() != 'connection')
+                entry.headers = headers
+                entry.request_time, entry.response_time = request_time, time.time()
+                with self._lock:
+                    variants = [variant for variant in self.variants(key) if variant.vary != entry.vary]
+                    self.save(key, variants + [entry])
+                self.revalidated += 1
+                return self.hit(entry, entry.age(time.time()), file, handler)
+            file.close()
+            self.misses += 1
+        if handler.command != 'GET' or response.status not in CACHEABLE:
+            return None
+        request = cache_control(handler.headers)
+        directives = cache_control(response.msg)
+        if 'no-store' in request or 'no-store' in directives or (self.shared and 'private' in directives):
+            return None
+        if 'Authorization' in handler.headers and not ({'public', 's-maxage', 'must-revalidate'} & set(directives)):
+            return None
+        vary = [name.strip().lower() for value in response.msg.get_all('Vary', []) for name in value.split(',')]
+        if '*' in vary:
+            return None
+        length = seconds(response.msg.get('Content-Length'))
+        if length is not None and length > self.max_object:
+            return None
+        headers = [(keyword, value) for keyword, value in response.msg.items()
+                   if keyword.lower() not in ('connection', 'keep-alive', 'transfer-encoding', 'content-length')]
+        entry = Entry(response.status, response.reason, headers,
+                      {name: handler.headers.get(name) for name in vary if name},
+                      None, None, time.time(), time.time())
+        if not entry.lifetime(self.shared) and not any(name in response.msg for name in ('ETag', 'Last-Modified')):
+            return None
+        self._pending[handler] = Pending(self.tmp, key, entry)
+        return None
+    
+    def filters(self, handler):
+        return handler in self._pending
+    
+    def response_data(self, data, handler):
+        pending = self._pending.get(handler)
+        if pending is not None:
+            pending.write(data)
+            if pending.size > self.max_object:
+                del self._pending[handler]
+                pending.discard()
+        return data
+    
+    def response_end(self, data, handler):
+        pending = self._pending.get(handler)
+        if pending is not None:
+            pending.complete = True
+        return data
+    
+    def finished(self, none, handler):
+        revalidating = self._revalidating.pop(handler, None)
+        if revalidating is not None:
+            revalidating[1].close()
+        pending = self._pending.pop(handler, None)
+        if pending is None:
+            return
+        length = seconds(handler.response.msg.get('Content-Length'))
+        if not pending.complete or (length is not None and length != pending.size):
+            pending.discard()
+            return
+        pending.file.close()
+        entry = pending.entry
+        entry.digest = pending.hash.hexdigest()
+        entry.size = pending.size
+        entry.headers.append(('Content-Length', str(pending.size)))
+        path = self.object_path(entry.digest)
+        with self._lock:
+            if entry.digest in self._objects:
+                os.unlink(pending.file.name)
+                os.utime(path)
+                self._objects.move_to_end(entry.digest)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(pending.file.name, path)
+                self._objects[entry.digest] = entry.size
+                self.size += entry.size
+            variants = [variant for variant in self.variants(pending.key) if variant.vary != entry.vary]
+            self.save(pending.key, variants + [entry])
+            self.stored += 1
+            self.evict()
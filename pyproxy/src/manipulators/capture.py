@@ -0,0 +1,192 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import time
+import threading
+import mimetypes
+
+from itertools import count
+from collections import deque
+from urllib.parse import urlsplit, unquote
+
+UNSAFE = re.compile(r'[^\w.-]+')
+TEMPLATE = '{host}/{time}-{id}-{name}{ext}'
+
+def sanitize(value):
+    return UNSAFE.sub('_', value).strip('._') or '_'
+
+class Stream():
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.size = 0
+        self.complete = False
+        self.dropped = False
+
+class Sink():
+    def __init__(self, directory='captures', max_buffer=16 << 20):
+        self.directory = directory
+        self.max_buffer = max_buffer
+        self.buffered = 0
+        self.started = 0
+        self.completed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.written = 0
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='capture-sink', daemon=True)
+        self._thread.start()
+    
+    def open(self, name):
+        stream = Stream(os.path.join(self.directory, name))
+        with self._condition:
+            self.started += 1
+        return stream
+    
+    def write(self, stream, data):
+        if stream.dropped or not data:
+            return
+        with self._condition:
+            if self.buffered + len(data) > self.max_buffer:
+                stream.dropped = True
+                return
+            self.buffered += len(data)
+            self._pending.append((stream, data))
+            self._condition.notify()
+    
+    def close(self, stream):
+        with self._condition:
+            self._pending.append((stream, None))
+            self._condition.notify()
+    
+    def shutdown(self):
+        with self._condition:
+            self._pending.append((None, None))
+            self._condition.notify()
+        self._thread.join()
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                items = list(self._pending)
+                self._pending.clear()
+            written = 0
+            for stream, data in items:
+                if stream is None:
+                    return
+                if data is None:
+                    self._finish(stream)
+                else:
+                    written += len(data)
+                    self._write(stream, data)
+            with self._condition:
+                self.buffered -= written
+    
+    def _write(self, stream, data):
+        if stream.dropped:
+            return
+        try:
+            if stream.file is None:
+                stream.file = self._create(stream.path)
+            stream.file.write(data)
+            stream.size += len(data)
+        except OSError:
+            stream.dropped = True
+            with self._condition:
+                self.failed += 1
+    
+    def _create(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        root, ext = os.path.splitext(path)
+        for number in count():
+            try:
+                return open('{}-{}{}'.format(root, number, ext) if number else path, 'xb')
+            except FileExistsError:
+                pass
+    
+    def _finish(self, stream):
+        if stream.file is not None:
+            stream.file.close()
+        if stream.complete and not stream.dropped:
+            if stream.file is not None:
+                with self._condition:
+                    self.completed += 1
+                    self.written += stream.size
+            return
+        with self._condition:
+            self.dropped += 1
+        if stream.file is not None:
+            try:
+                os.unlink(stream.file.name)
+            except OSError:
+                pass
+
+class Capture():
+    priority = 50
+    nonblocking = True
+    def __init__(self, patterns, template=TEMPLATE, sink=None, plaintext=True, hosts=()):
+        self.patterns = [re.compile(pattern) if isinstance(pattern, str) else pattern for pattern in patterns]
+        self.template = template
+        self.sink = Sink() if sink is None else sink
+        self.decode = plaintext
+        self.hosts = hosts
+        self._ids = count(1)
+        self._streams = {}
+    
+    def filename(self, handler, headers):
+        url = urlsplit(handler.path)
+        segments = [sanitize(unquote(segment)) for segment in url.path.split('/') if segment]
+        name, ext = os.path.splitext(segments.pop() if segments else 'index')
+        ext = mimetypes.guess_extension(headers.get('Content-Type', '').partition(';')[0].strip()) or ext
+        return self.template.format(host=sanitize(url.hostname or ''), path='/'.join(segments) or '_',
+                                    name=name or '_', ext=ext, method=sanitize(handler.command),
+                                    time=time.strftime('%Y%m%d-%H%M%S'), id=next(self._ids))
+    
+    def captures(self, handler):
+        return any(pattern.match(handler.path) for pattern in self.patterns)
+    
+    def plaintext(self, handler):
+        return self.decode and self.captures(handler)
+    
+    def response_headers(self, headers, handler):
+        if self.captures(handler):
+            self._streams[handler] = self.sink.open(self.filename(handler, headers))
+        return headers
+    
+    def filters(self, handler):
+        return handler in self._streams
+    
+    def response_data(self, data, handler):
+        stream = self._streams.get(handler)
+        if stream is not None:
+            self.sink.write(stream, data)
+        return data
+    
+    def response_end(self, data, handler):
+        stream = self._streams.get(handler)
+        if stream is not None:
+            self.sink.write(stream, data)
+            stream.complete = True
+        return data
+    
+    def finished(self, none, handler):
+        stream = self._streams.pop(handler, None)
+        if stream is not None:
+            self.sink.close(stream)
@@ -15,21 +15,10 @@
 
 import re
 
+from manipulators.capture import Capture
+
 STREAM_MATCH = re.compile('.*grooveshark\.com\/stream\.php')
 
-class Grooveshark():
-    priority = 50
-    def __init__(self):
-        self._streams = {}
-        
-    def response_data(self, data, handler):
-        if STREAM_MATCH.match(handler.path):
-            if not handler in self._streams:
-                print('Grooveshark - Stream')
-                self._streams[handler] = open(input('Filename: '), 'wb')
-            self._streams[handler].write(data)    
-        return data
-    
-    def finished(self, none, handler):
-        if handler in self._streams:
-            self._streams[handler].close()
\ No newline at end of file
+class Grooveshark(Capture):
+    def __init__(self, template='grooveshark/{time}-{id}{ext}', sink=None):
+        Capture.__init__(self, (STREAM_MATCH,), template, sink, hosts=('grooveshark.com', '*.grooveshark.com'))
@@ -15,19 +15,156 @@
 
 import zlib
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODINGS = {'gzip': 'gzip', 'x-gzip': 'gzip', 'deflate': 'deflate'}
+ERRORS = (zlib.error,)
+if brotli is not None:
+    ENCODINGS['br'] = 'br'
+    ERRORS += (brotli.error,)
+
+def plaintext(handler):
+    manipulator = getattr(handler.server, 'manipulator', None)
+    return manipulator is None or manipulator.wants('plaintext', handler)
+
+def bodiless(handler):
+    response = getattr(handler, 'response', None)
+    return handler.command == 'HEAD' or getattr(response, 'status', None) in (204, 304)
+
+class Decoder():
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.failed = False
+        self._raw = bytearray()
+        self._pending = b''
+        if encoding == 'br':
+            self._decoder = brotli.Decompressor()
+        elif encoding == 'gzip':
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._decoder = None
+    
+    def decode(self, data):
+        if self.failed:
+            return data
+        if self._raw is not None:
+            self._raw += data
+        try:
+            output = self._decode(data)
+        except ERRORS:
+            self.failed = True
+            return data if self._raw is None else bytes(self._raw)
+        if output:
+            self._raw = None
+        return output
+    
+    def _decode(self, data):
+        if self.encoding == 'br':
+            return self._decoder.process(data)
+        if self._decoder is None:
+            data = self._pending + data
+            if len(data) < 2:
+                self._pending = data
+                return b''
+            self._pending = b''
+            wrapped = data[0] & 0x0f == 8 and not (data[0] << 8 | data[1]) % 31
+            self._decoder = zlib.decompressobj(zlib.MAX_WBITS if wrapped else -zlib.MAX_WBITS)
+        output = self._decoder.decompress(data)
+        while self.encoding == 'gzip' and self._decoder.eof and self._decoder.unused_data.strip(b'\0'):
+            data = self._decoder.unused_data
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            output += self._decoder.decompress(data)
+        return output
+    
+    def flush(self):
+        if self.failed or self.encoding == 'br':
+            return b''
+        if self._decoder is None:
+            return self._pending
+        try:
+            return self._decoder.flush()
+        except zlib.error:
+            return b''
+
+class Encoder():
+    def __init__(self, encoding, level=6):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._encoder = brotli.Compressor(quality=level)
+        else:
+            self._encoder = zlib.compressobj(level, zlib.DEFLATED,
+                                             16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS)
+    
+    def encode(self, data):
+        if self.encoding == 'br':
+            return self._encoder.process(data) + self._encoder.flush()
+        return self._encoder.compress(data) + self._encoder.flush(zlib.Z_SYNC_FLUSH)
+    
+    def finish(self, data=b''):
+        if self.encoding == 'br':
+            return self._encoder.process(data) + self._encoder.finish()
+        return self._encoder.compress(data) + self._encoder.flush()
+
 class Unzip():
     priority = 0
+    def __init__(self):
+        self._decoders = {}
+    
+    def response_headers(self, headers, handler):
+        encoding = ENCODINGS.get(headers.get('Content-Encoding', '').strip().lower())
+        if encoding and plaintext(handler):
+            self._decoders[handler] = Decoder(encoding)
+            handler.content_encoding = encoding
+            del headers['Content-Encoding']
+            del headers['Content-Length']
+        return headers
+    
+    def filters(self, handler):
+        return handler in self._decoders
+    
     def response_data(self, data, handler):
-        if 'Content-Encoding' in handler.headers:
-            if handler.headers['Content-Encoding'] == 'gzip':
-                return zlib.decompress(data)
+        if handler in self._decoders:
+            return self._decoders[handler].decode(data)
+        return data
+    
+    def response_end(self, data, handler):
+        if handler in self._decoders:
+            return self._decoders[handler].flush() + data
         return data
     
+    def finished(self, none, handler):
+        self._decoders.pop(handler, None)
+    
 class Zip():
     priority = 100
+    def __init__(self, level=6):
+        self.level = level
+        self._encoders = {}
+    
+    def response_headers(self, headers, handler):
+        encoding = getattr(handler, 'content_encoding', None)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+            if not bodiless(handler):
+                self._encoders[handler] = Encoder(encoding, self.level)
+                del headers['Content-Length']
+        return headers
+    
+    def filters(self, handler):
+        return handler in self._encoders
+    
     def response_data(self, data, handler):
-        if 'Content-Encoding' in handler.headers:
-            if handler.headers['Content-Encoding'] == 'gzip':
-                return zlib.compress(data)
+        if handler in self._encoders:
+            return self._encoders[handler].encode(data)
         return data
-        
\ No newline at end of file
+    
+    def response_end(self, data, handler):
+        if handler in self._encoders:
+            return self._encoders[handler].finish(data)
+        return data
+    
+    def finished(self, none, handler):
+        self._encoders.pop(handler, None)
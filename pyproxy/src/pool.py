@@ -0,0 +1,303 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import ssl
+import time
+import select
+import asyncio
+import threading
+
+from io import BytesIO
+from http.client import HTTPConnection, HTTPSConnection, HTTPMessage, BadStatusLine, parse_headers
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+CHUNK_SIZE = re.compile(rb'[0-9A-Fa-f]+')
+
+def parse_length(value):
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError('invalid Content-Length {!r}'.format(value))
+    return int(value)
+
+def parse_chunk_size(line):
+    size = line.split(b';', 1)[0].rstrip(b' \t\r\n')
+    if not CHUNK_SIZE.fullmatch(size):
+        raise ValueError('invalid chunk size {!r}'.format(line))
+    return int(size, 16)
+
+class ConnectionPool():
+    def __init__(self, max_size=8, idle_timeout=60, timeout=30, context=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.context = ssl.create_default_context() if context is None else context
+        self.created = 0
+        self.reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+    
+    def origin(self, scheme, host, port=None):
+        return scheme, host, port or DEFAULT_PORTS.get(scheme, 80)
+    
+    def connect(self, origin):
+        scheme, host, port = origin
+        if scheme == 'https':
+            connection = HTTPSConnection(host, port, timeout=self.timeout, context=self.context)
+        else:
+            connection = HTTPConnection(host, port, timeout=self.timeout)
+        connection.origin = origin
+        connection.reused = False
+        self.created += 1
+        return connection
+    
+    def checkout(self, origin):
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(origin, [])
+            while idle:
+                connection, released = idle.pop()
+                if now - released < self.idle_timeout and self.healthy(connection):
+                    connection.reused = True
+                    self.reused += 1
+                    return connection
+                connection.close()
+    
+    def acquire(self, scheme, host, port=None):
+        origin = self.origin(scheme, host, port)
+        return self.checkout(origin) or self.connect(origin)
+    
+    def release(self, connection):
+        with self._lock:
+            idle = self._idle.setdefault(connection.origin, [])
+            if len(idle) < self.max_size and self.alive(connection):
+                idle.append((connection, time.monotonic()))
+                return
+        connection.close()
+    
+    def alive(self, connection):
+        return connection.sock is not None
+    
+    def healthy(self, connection):
+        if connection.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([connection.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+    
+    def request(self, scheme, host, port, method, target, body=None, headers=None, retry=True):
+        while True:
+            connection = self.acquire(scheme, host, port)
+            try:
+                connection.request(method, target, body, headers or {})
+                return connection, connection.getresponse()
+            except (ConnectionError, BadStatusLine):
+                connection.close()
+                if not (retry and connection.reused):
+                    raise
+            except BaseException:
+                connection.close()
+                raise
+    
+    def purge(self):
+        now = time.monotonic()
+        with self._lock:
+            for origin, idle in self._idle.items():
+                for connection, released in idle:
+                    if now - released >= self.idle_timeout:
+                        connection.close()
+                idle[:] = [(connection, released) for connection, released in idle
+                           if now - released < self.idle_timeout]
+    
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for connection, released in idle:
+                    connection.close()
+            self._idle.clear()
+
+class AsyncBody():
+    def __init__(self, reader, length=None, chunked=False):
+        self.reader = reader
+        self.length = length
+        self.chunked = chunked
+        self.closed = not chunked and length == 0
+        self._left = 0
+    
+    @classmethod
+    def from_headers(cls, reader, headers):
+        if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+            return cls(reader, chunked=True)
+        if 'Content-Length' in headers:
+            return cls(reader, parse_length(headers['Content-Length']))
+    
+    async def read(self, amt=None):
+        if amt is None:
+            chunks = []
+            data = await self.read(65536)
+            while data:
+                chunks.append(data)
+                data = await self.read(65536)
+            return b''.join(chunks)
+        if self.closed:
+            return b''
+        if self.chunked:
+            return await self._read_chunked(amt)
+        if self.length is None:
+            data = await self.reader.read(amt)
+            self.closed = not data
+            return data
+        data = await self.reader.read(min(amt, self.length))
+        if not data:
+            raise asyncio.IncompleteReadError(data, self.length)
+        self.length -= len(data)
+        self.closed = self.length == 0
+        return data
+    
+    async def _read_chunked(self, amt):
+        if not self._left:
+            line = await self.reader.readline()
+            try:
+                size = parse_chunk_size(line)
+            except ValueError:
+                raise BadStatusLine(line)
+            if not size:
+                line = await self.reader.readline()
+                while line not in (b'\r\n', b'\n', b''):
+                    line = await self.reader.readline()
+                self.closed = True
+                return b''
+            self._left = size
+        data = await self.reader.read(min(amt, self._left))
+        if not data:
+            raise asyncio.IncompleteReadError(data, self._left)
+        self._left -= len(data)
+        if not self._left:
+            await self.reader.readexactly(2)
+        return data
+    
+    def isclosed(self):
+        return self.closed
+
+class AsyncResponse(AsyncBody):
+    def __init__(self, reader, head, method):
+        line, _, rest = head.partition(b'\r\n')
+        try:
+            version, status, *reason = line.decode('iso-8859-1').split(None, 2)
+            self.status = int(status)
+        except ValueError:
+            raise BadStatusLine(line)
+        if not version.startswith('HTTP/'):
+            raise BadStatusLine(line)
+        self.version = version
+        self.reason = reason[0] if reason else ''
+        self.msg = parse_headers(BytesIO(rest))
+        connection = self.msg.get('Connection', '').lower()
+        self.will_close = 'close' in connection or (version == 'HTTP/1.0' and 'keep-alive' not in connection)
+        if method == 'HEAD' or self.status in (204, 304) or self.status < 200:
+            super().__init__(reader, 0)
+        elif 'chunked' in self.msg.get('Transfer-Encoding', '').lower():
+            super().__init__(reader, chunked=True)
+        elif 'Content-Length' in self.msg:
+            try:
+                length = parse_length(self.msg['Content-Length'])
+            except ValueError:
+                raise BadStatusLine(line)
+            super().__init__(reader, length)
+        else:
+            super().__init__(reader)
+            self.will_close = True
+
+class AsyncConnection():
+    def __init__(self, origin, reader, writer, timeout=None):
+        self.origin = origin
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.reused = False
+    
+    async def request(self, method, target, body=None, headers=None):
+        headers = HTTPMessage() if headers is None else headers
+        if 'Host' not in headers:
+            scheme, host, port = self.origin
+            headers['Host'] = host if port == DEFAULT_PORTS.get(scheme) else '{}:{}'.format(host, port)
+        chunked = False
+        if isinstance(body, bytes):
+            del headers['Content-Length']
+            headers['Content-Length'] = str(len(body))
+        elif body is not None and 'Content-Length' not in headers:
+            headers['Transfer-Encoding'] = 'chunked'
+            chunked = True
+        lines = ['{} {} HTTP/1.1\r\n'.format(method, target)]
+        lines.extend('{}: {}\r\n'.format(keyword, value) for keyword, value in headers.items())
+        lines.append('\r\n')
+        self.writer.write(''.join(lines).encode('iso-8859-1'))
+        if isinstance(body, bytes):
+            self.writer.write(body)
+        elif body is not None:
+            async for data in body:
+                if chunked:
+                    self.writer.writelines((b'%x\r\n' % len(data), data, b'\r\n'))
+                else:
+                    self.writer.write(data)
+                await self.writer.drain()
+            if chunked:
+                self.writer.write(b'0\r\n\r\n')
+        await self.writer.drain()
+        response = AsyncResponse(self.reader, await self.head(), method)
+        while response.status < 200:
+            response = AsyncResponse(self.reader, await self.head(), method)
+        return response
+    
+    def head(self):
+        return asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), self.timeout)
+    
+    def close(self):
+        self.writer.close()
+
+class AsyncConnectionPool(ConnectionPool):
+    limit = 1 << 18
+    
+    async def connect(self, origin):
+        scheme, host, port = origin
+        context = self.context if scheme == 'https' else None
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=context, limit=self.limit),
+                                                self.timeout)
+        self.created += 1
+        return AsyncConnection(origin, reader, writer, self.timeout)
+    
+    async def acquire(self, scheme, host, port=None):
+        origin = self.origin(scheme, host, port)
+        return self.checkout(origin) or await self.connect(origin)
+    
+    def alive(self, connection):
+        return not connection.writer.is_closing()
+    
+    def healthy(self, connection):
+        return self.alive(connection) and not connection.reader.at_eof()
+    
+    async def request(self, scheme, host, port, method, target, body=None, headers=None, retry=True):
+        while True:
+            connection = await self.acquire(scheme, host, port)
+            try:
+                return connection, await connection.request(method, target, body, headers)
+            except (ConnectionError, asyncio.IncompleteReadError, BadStatusLine):
+                connection.close()
+                if not (retry and connection.reused):
+                    raise
+            except BaseException:
+                connection.close()
+                raise
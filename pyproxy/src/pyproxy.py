@@ -13,15 +13,86 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from ssl import wrap_socket, SSLError
+import os
+import time
+import socket
+import fcntl
+import select
+import asyncio
+import fnmatch
+
+from ssl import wrap_socket, SSLSocket
 from socketserver import ThreadingMixIn
-from urllib.request import Request, urlopen, URLError
-from http.client import BadStatusLine
+from urllib.parse import urlsplit, urlunsplit
+from http.client import HTTPConnection, HTTPMessage, HTTPException
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
+from pool import ConnectionPool, parse_length, parse_chunk_size
+from collapse import Collapser
+from certs import split_host
+from tunnel import split_target, pump
+
 KEYFILE = 'certs/example.key'
 CERTFILE = 'certs/example.crt'
 BLOCKSIZE = 2048
+MAX_BLOCKSIZE = 1 << 18
+WRITE_BATCH = 1 << 16
+TUNNEL_TIMEOUT = 30
+FAST_READ = 0.002
+SLOW_READ = 0.05
+HOP_BY_HOP = ('connection', 'keep-alive', 'proxy-connection', 'proxy-authenticate', 'proxy-authorization',
+              'te', 'trailer', 'transfer-encoding', 'upgrade')
+HOOKS = ('started', 'request_path', 'request_headers', 'request_data', 'request_end', 'cached', 'blocksize',
+         'response_headers', 'response_data', 'response_end', 'error_code', 'error_msg', 'error_headers',
+         'finished')
+
+def end_to_end(headers):
+    hop_by_hop = set(HOP_BY_HOP)
+    for value in headers.get_all('Connection', []):
+        hop_by_hop.update(name.strip().lower() for name in value.split(','))
+    message = HTTPMessage()
+    for keyword, value in headers.items():
+        if keyword.lower() not in hop_by_hop:
+            message[keyword] = value
+    return message
+
+def adapt_blocksize(blocksize, elapsed):
+    if elapsed < FAST_READ:
+        return min(blocksize * 2, MAX_BLOCKSIZE)
+    if elapsed > SLOW_READ:
+        return max(blocksize // 2, BLOCKSIZE)
+    return blocksize
+
+def read_chunked(rfile):
+    while True:
+        line = rfile.readline()
+        size = parse_chunk_size(line)
+        if not size:
+            break
+        while size:
+            data = rfile.read(min(size, BLOCKSIZE))
+            if not data:
+                raise ConnectionError('request body truncated')
+            size -= len(data)
+            yield data
+        rfile.readline()
+    line = rfile.readline()
+    while line not in (b'\r\n', b'\n', b''):
+        line = rfile.readline()
+
+def read_length(rfile, length):
+    while length:
+        data = rfile.read(min(length, BLOCKSIZE))
+        if not data:
+            raise ConnectionError('request body truncated')
+        length -= len(data)
+        yield data
+
+def request_chunks(rfile, headers):
+    if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+        return read_chunked(rfile)
+    if 'Content-Length' in headers:
+        return read_length(rfile, parse_length(headers['Content-Length']))
 
 class Proxy(BaseHTTPRequestHandler):
     def __init__(self, request, client_address, server, host=False):
@@ -30,50 +101,216 @@ class Proxy(BaseHTTPRequestHandler):
         
     def _proxy(self):
         self.server.manipulate('started', None, self)
+        try:
+            self._forward()
+        finally:
+            self.server.manipulate('finished', None, self)
+    
+    def _forward(self):
+        self.response = None
         if self.host:
             self.path = 'https://{host}{path}'.format(host=self.host, path=self.path)
+        try:
+            chunks = request_chunks(self.rfile, self.headers)
+        except ValueError:
+            self.send_error(400, 'Bad Content-Length')
+            return
         self.path = self.server.manipulate('request_path', self.path, self)
         self.headers = self.server.manipulate('request_headers', self.headers, self)
-        request = Request(self.path, headers=self.headers)
-        request.get_method = lambda: self.command
-        if 'Content-Length' in self.headers:
-            post_data = self.rfile.read(int(self.headers['Content-Length']))
-            request.add_data(self.server.manipulate('request_data', post_data, self))
+        post_data = None if chunks is None else self._stream_body(chunks)
+        hit = self.server.manipulate('cached', None, self)
+        if hit is not None:
+            self.send_cached(hit)
+            return
+        headers = end_to_end(self.headers)
+        if chunks is not None:
+            manipulator = getattr(self.server, 'manipulator', None)
+            if 'chunked' in self.headers.get('Transfer-Encoding', '').lower() or (
+                    manipulator is None or manipulator.implements('request_data')):
+                del headers['Content-Length']
+        url = urlsplit(self.path)
+        target = urlunsplit(('', '', url.path or '/', url.query, ''))
         try:
-            response = urlopen(request)
-            self.send_response(200)
-            headers = self.server.manipulate('response_headers', response.info(), self)
-            for keyword, value in headers.items():
-                self.send_header(keyword, value)
-            self.end_headers()
-            blocksize = self.server.manipulate('blocksize', BLOCKSIZE, self)
-            if blocksize:
-                data = self.server.manipulate('response_data', response.read(blocksize), self)
-                while data:
-                    self.wfile.write(data)
-                    data = self.server.manipulate('response_data', response.read(blocksize), self)
+            connection, response = self.server.pool.request(url.scheme, url.hostname, url.port, self.command,
+                                                            target, post_data, headers, post_data is None)
+        except ValueError:
+            self.send_error(400, 'Malformed request body')
+            return
+        except (OSError, HTTPException) as error:
+            self.send_error(502, str(error))
+            return
+        try:
+            self.response = response
+            hit = self.server.manipulate('cached', None, self)
+            if hit is not None:
+                response.read()
+            elif response.status >= 400:
+                code = self.server.manipulate('error_code', response.status, self)
+                msg = self.server.manipulate('error_msg', response.reason, self)
+                self.send_response(code, msg)
+                headers = self.server.manipulate('error_headers', end_to_end(response.msg), self)
             else:
-                self.wfile.write(self.server.manipulate('response_data', response.read(), self))
-        except URLError as error:
-            code = self.server.manipulate('error_code', error.getcode(), self)
-            msg = self.server.manipulate('error_msg', error.msg, self)
-            self.send_response(code, msg)
-            headers = self.server.manipulate('error_headers', error.headers, self)
-            for keyword, value in headers.items():
+                self.send_response(response.status, response.reason)
+                headers = self.server.manipulate('response_headers', end_to_end(response.msg), self)
+            if hit is None:
+                for keyword, value in headers.items():
+                    self.send_header(keyword, value)
+                self.end_headers()
+                blocksize = self.server.manipulate('blocksize', BLOCKSIZE, self)
+                manipulator = getattr(self.server, 'manipulator', None)
+                if not blocksize:
+                    self.wfile.write(self.server.manipulate('response_data', response.read(), self))
+                elif manipulator is None or manipulator.filters(self):
+                    self._filter(response, blocksize)
+                elif not self._splice(connection, response):
+                    self._copy(response, blocksize)
+                self.wfile.write(self.server.manipulate('response_end', b'', self))
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close or not response.isclosed():
+            connection.close()
+        else:
+            self.server.pool.release(connection)
+        if hit is not None:
+            self.send_cached(hit)
+    
+    def _filter(self, response, blocksize):
+        batch, batched = [], 0
+        start = time.monotonic()
+        data = response.read(blocksize)
+        while data:
+            elapsed = time.monotonic() - start
+            filled = len(data) == blocksize
+            data = self.server.manipulate('response_data', data, self)
+            if data:
+                batch.append(data)
+                batched += len(data)
+            if batched >= WRITE_BATCH or not filled or elapsed > SLOW_READ:
+                self.wfile.write(b''.join(batch))
+                batch, batched = [], 0
+            blocksize = adapt_blocksize(blocksize, elapsed)
+            start = time.monotonic()
+            data = response.read(blocksize)
+        if batch:
+            self.wfile.write(b''.join(batch))
+    
+    def _copy(self, response, blocksize):
+        view = memoryview(bytearray(MAX_BLOCKSIZE))
+        start = time.monotonic()
+        count = response.readinto(view[:blocksize])
+        while count:
+            self.wfile.write(view[:count])
+            blocksize = adapt_blocksize(blocksize, time.monotonic() - start)
+            start = time.monotonic()
+            count = response.readinto(view[:blocksize])
+    
+    def _splice(self, connection, response):
+        if (not hasattr(os, 'splice') or not isinstance(connection, HTTPConnection) or response.chunked
+                or not response.length or isinstance(connection.sock, SSLSocket)
+                or isinstance(self.connection, SSLSocket)):
+            return False
+        self.wfile.write(response.read(min(len(response.fp.peek(1)), response.length)))
+        source, target = connection.sock.fileno(), self.connection.fileno()
+        pipe_read, pipe_write = os.pipe()
+        try:
+            if hasattr(fcntl, 'F_SETPIPE_SZ'):
+                try:
+                    fcntl.fcntl(pipe_write, fcntl.F_SETPIPE_SZ, MAX_BLOCKSIZE)
+                except OSError:
+                    pass
+            left = response.length
+            while left:
+                try:
+                    count = os.splice(source, pipe_write, min(left, MAX_BLOCKSIZE), flags=os.SPLICE_F_MOVE)
+                except BlockingIOError:
+                    if not select.select([source], [], [], connection.sock.gettimeout())[0]:
+                        raise TimeoutError('upstream read timed out')
+                    continue
+                if not count:
+                    raise ConnectionError('upstream closed during splice')
+                left -= count
+                while count:
+                    try:
+                        count -= os.splice(pipe_read, target, count, flags=os.SPLICE_F_MOVE)
+                    except BlockingIOError:
+                        select.select([], [target], [])
+        finally:
+            os.close(pipe_read)
+            os.close(pipe_write)
+        response.length = 0
+        response.read()
+        return True
+    
+    def _stream_body(self, chunks):
+        for data in chunks:
+            data = self.server.manipulate('request_data', data, self)
+            if data:
+                yield data
+        data = self.server.manipulate('request_end', b'', self)
+        if data:
+            yield data
+    
+    def send_cached(self, hit):
+        try:
+            self.send_response(hit.status, hit.reason)
+            for keyword, value in hit.headers.items():
                 self.send_header(keyword, value)
             self.end_headers()
-        except BadStatusLine as error:
-            pass
-        self.server.manipulate('finished', None, self)
+            if hit.file is not None and self.command != 'HEAD':
+                self.connection.sendfile(hit.file)
+        finally:
+            if hit.file is not None:
+                hit.file.close()
         
     def do_CONNECT(self):
+        host = self.headers.get('Host', self.path)
+        manipulator = getattr(self.server, 'manipulator', None)
+        if manipulator is not None and not manipulator.intercepts(split_host(host)):
+            self._tunnel()
+            return
         self.send_response(200)
         self.end_headers()
         try:
-            connection = wrap_socket(self.connection, keyfile=KEYFILE, certfile=CERTFILE, server_side=True)
-            Proxy(connection, self.client_address, self.server, self.headers['Host'])
-        except SSLError:
+            authority = getattr(self.server, 'authority', None)
+            if authority is None:
+                connection = wrap_socket(self.connection, keyfile=KEYFILE, certfile=CERTFILE, server_side=True)
+            else:
+                connection = authority.context(host).wrap_socket(self.connection, server_side=True)
+            Proxy(connection, self.client_address, self.server, host)
+        except (OSError, ValueError):
+            pass
+    
+    def _tunnel(self):
+        self.close_connection = True
+        try:
+            upstream = socket.create_connection(split_target(self.path), TUNNEL_TIMEOUT)
+        except (OSError, ValueError) as error:
+            self.send_error(502, str(error))
+            return
+        try:
+            self.send_response(200, 'Connection established')
+            self.end_headers()
+            upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            pending = self._buffered()
+            if pending:
+                upstream.sendall(pending)
+            pump(self.connection, upstream)
+        except OSError:
             pass
+        finally:
+            upstream.close()
+        
+    def _buffered(self):
+        timeout = self.connection.gettimeout()
+        self.connection.setblocking(False)
+        try:
+            pending = self.rfile.peek()
+        except BlockingIOError:
+            pending = b''
+        finally:
+            self.connection.settimeout(timeout)
+        return self.rfile.read(len(pending)) if pending else b''
         
     do_GET = _proxy
     do_POST = _proxy
@@ -88,30 +325,99 @@ class ThreadingHTTPServer(ThreadingMixIn, HTTPServer): pass
 class Manipulator():
     def __init__(self):
         self._manipulators = []
+        self._hooks = {}
+        self._async_hooks = {}
+        self._wants = {}
+        self._filters = []
+        self._hosts = []
+        self._intercepts = {}
     
     def load(self, manipulator):
         self._manipulators.append(manipulator)
+        self._rebuild()
     
-    def manipulate(self, function, value, handler):
+    def load_many(self, manipulators):
+        self._manipulators.extend(manipulators)
+        self._rebuild()
+    
+    def _rebuild(self):
+        hooks, async_hooks = {}, {}
         for manipulator in sorted(self._manipulators, key=lambda manipulator: manipulator.priority):
-            if hasattr(manipulator, function):
-                value = getattr(manipulator, function)(value, handler)
+            nonblocking = getattr(manipulator, 'nonblocking', False)
+            for function in HOOKS:
+                hook = getattr(manipulator, function, None)
+                if callable(hook):
+                    hooks.setdefault(function, []).append(hook)
+                    async_hooks.setdefault(function, []).append((hook, asyncio.iscoroutinefunction(hook),
+                                                                 nonblocking))
+        self._async_hooks = async_hooks
+        self._hooks = hooks
+        self._wants = {}
+        self._filters = [getattr(manipulator, 'filters', None) for manipulator in self._manipulators
+                         if callable(getattr(manipulator, 'response_data', None))]
+        self._hosts = [pattern.lower() for manipulator in self._manipulators
+                       for pattern in getattr(manipulator, 'hosts', ())]
+        self._intercepts = {}
+    
+    def manipulate(self, function, value, handler):
+        for hook in self._hooks.get(function, ()):
+            value = hook(value, handler)
+        return value
+    
+    def implements(self, function):
+        return function in self._hooks
+    
+    def filters(self, handler):
+        return any(filters is None or filters(handler) for filters in self._filters)
+    
+    def wants(self, attribute, handler=None):
+        if attribute not in self._wants:
+            self._wants[attribute] = [getattr(manipulator, attribute) for manipulator in self._manipulators
+                                      if getattr(manipulator, attribute, False)]
+        return any(not callable(wanted) or wanted(handler) for wanted in self._wants[attribute])
+    
+    def intercepts(self, host):
+        host = host.lower()
+        if host not in self._intercepts:
+            if len(self._intercepts) >= 4096:
+                self._intercepts.clear()
+            self._intercepts[host] = any(fnmatch.fnmatchcase(host, pattern) for pattern in self._hosts)
+        return self._intercepts[host]
+    
+    async def manipulate_async(self, function, value, handler, executor=None):
+        hooks = self._async_hooks.get(function)
+        if not hooks:
+            return value
+        loop = asyncio.get_running_loop()
+        for hook, coroutine, nonblocking in hooks:
+            if coroutine:
+                value = await hook(value, handler)
+            elif nonblocking:
+                value = hook(value, handler)
+            else:
+                value = await loop.run_in_executor(executor, hook, value, handler)
         return value
 
 if __name__ == '__main__':
-    import os.path
-    import subprocess
-    if not os.path.exists(KEYFILE):
-        print('---- create certificate ----')
-        subprocess.call(['openssl', 'req', '-new', '-x509', '-days', '365', '-nodes', '-out', CERTFILE, '-keyout', KEYFILE])
-        print('---- certificate created ----')
+    import sys
+    from certs import CertificateAuthority
+    authority = CertificateAuthority()
+    authority.setup()
+    print('---- certificate authority: {} ----'.format(authority.ca_cert))
     print('---- starting proxy ----')
     manipulator = Manipulator()
     from manipulators.gzip import Unzip, Zip
-    manipulator.load(Unzip())
-    manipulator.load(Zip())
+    from manipulators.cache import Cache
     from manipulators.grooveshark import Grooveshark
-    manipulator.load(Grooveshark())
-    server = ThreadingHTTPServer(('127.0.0.1', 8080), Proxy)
-    server.manipulate = manipulator.manipulate
-    server.serve_forever()
\ No newline at end of file
+    manipulator.load_many((Cache(), Unzip(), Zip(), Grooveshark()))
+    collapse = '--collapse' in sys.argv
+    if '--threaded' in sys.argv:
+        server = ThreadingHTTPServer(('127.0.0.1', 8080), Proxy)
+        server.manipulator = manipulator
+        server.manipulate = manipulator.manipulate
+        server.pool = Collapser(ConnectionPool()) if collapse else ConnectionPool()
+        server.authority = authority
+        server.serve_forever()
+    else:
+        from asyncproxy import serve
+        serve(manipulator, '127.0.0.1', 8080, authority=authority, collapse=collapse)
\ No newline at end of file
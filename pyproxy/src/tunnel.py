@@ -0,0 +1,106 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import socket
+import asyncio
+import selectors
+
+BLOCKSIZE = 1 << 16
+IDLE_TIMEOUT = 300
+
+def split_target(target, default_port=443):
+    if target.startswith('['):
+        host, _, port = target[1:].partition(']')
+        port = port.lstrip(':')
+    elif target.count(':') == 1:
+        host, _, port = target.partition(':')
+    else:
+        host, port = target, ''
+    return host, int(port) if port else default_port
+
+def pump(left, right, timeout=IDLE_TIMEOUT):
+    peers = {left: right, right: left}
+    view = memoryview(bytearray(BLOCKSIZE))
+    selector = selectors.DefaultSelector()
+    try:
+        for sock in peers:
+            sock.settimeout(timeout)
+            selector.register(sock, selectors.EVENT_READ)
+        while selector.get_map():
+            events = selector.select(timeout)
+            if not events:
+                break
+            for key, mask in events:
+                source, target = key.fileobj, peers[key.fileobj]
+                try:
+                    count = source.recv_into(view)
+                except ConnectionError:
+                    count = 0
+                if count:
+                    try:
+                        target.sendall(view[:count])
+                    except OSError:
+                        return
+                    continue
+                selector.unregister(source)
+                try:
+                    target.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+    finally:
+        selector.close()
+
+class Idle():
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.touch()
+    
+    def touch(self):
+        self.last = time.monotonic()
+    
+    def remaining(self):
+        return self.last + self.timeout - time.monotonic()
+
+async def receive(reader, idle):
+    while True:
+        remaining = idle.remaining()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        try:
+            data = await asyncio.wait_for(reader.read(BLOCKSIZE), remaining)
+        except asyncio.TimeoutError:
+            continue
+        idle.touch()
+        return data
+
+async def pipe(reader, writer, idle):
+    try:
+        data = await receive(reader, idle)
+        while data:
+            writer.write(data)
+            await asyncio.wait_for(writer.drain(), idle.timeout)
+            data = await receive(reader, idle)
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError, asyncio.TimeoutError):
+        pass
+
+async def splice(client_reader, client_writer, upstream_reader, upstream_writer, timeout=IDLE_TIMEOUT):
+    idle = Idle(timeout)
+    try:
+        await asyncio.gather(pipe(client_reader, upstream_writer, idle), pipe(upstream_reader, client_writer, idle))
+    finally:
+        upstream_writer.close()
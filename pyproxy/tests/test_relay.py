@@ -0,0 +1,134 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import threading
+import unittest
+
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from pool import ConnectionPool
+from pyproxy import Manipulator, Proxy, ThreadingHTTPServer
+from manipulators.gzip import Unzip, Zip
+from manipulators.capture import Capture, Sink
+
+BODY = os.urandom(1 << 20)
+COMPRESSED = gzip.compress(BODY)
+
+class Upstream(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def do_GET(self):
+        body = COMPRESSED if self.path.startswith('/gzip/') else BODY
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        if body is COMPRESSED:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+class Recording(Proxy):
+    spliced = []
+    
+    def _splice(self, connection, response):
+        spliced = super()._splice(connection, response)
+        self.spliced.append(spliced)
+        return spliced
+    
+    def log_message(self, format, *args):
+        pass
+
+class Upper():
+    priority = 0
+    
+    def response_data(self, data, handler):
+        return data.upper()
+
+def serve(server):
+    server.daemon_threads = True
+    server.block_on_close = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+class RelayTest(unittest.TestCase):
+    def setUp(self):
+        Recording.spliced = []
+        self.upstream = serve(ThreadingHTTPServer(('127.0.0.1', 0), Upstream))
+        self.manipulator = Manipulator()
+        self.proxy = ThreadingHTTPServer(('127.0.0.1', 0), Recording)
+        self.proxy.manipulator = self.manipulator
+        self.proxy.manipulate = self.manipulator.manipulate
+        self.proxy.pool = ConnectionPool()
+        serve(self.proxy)
+    
+    def tearDown(self):
+        self.proxy.pool.close()
+        for server in (self.proxy, self.upstream):
+            server.shutdown()
+            server.server_close()
+    
+    def fetch(self, path='/blob'):
+        connection = HTTPConnection('127.0.0.1', self.proxy.server_port, timeout=10)
+        try:
+            connection.request('GET', 'http://127.0.0.1:{}{}'.format(self.upstream.server_port, path))
+            response = connection.getresponse()
+            self.assertEqual(response.status, 200)
+            return response.read()
+        finally:
+            connection.close()
+    
+    def assertBody(self, body, expected):
+        self.assertTrue(body == expected, 'body differs: {} bytes, expected {}'.format(len(body), len(expected)))
+    
+    @unittest.skipUnless(hasattr(os, 'splice'), 'os.splice is not available')
+    def test_get_is_spliced(self):
+        self.assertBody(self.fetch(), BODY)
+        self.assertEqual(Recording.spliced, [True])
+    
+    def test_filtered_get_is_not_spliced(self):
+        self.manipulator.load(Upper())
+        self.assertBody(self.fetch(), BODY.upper())
+        self.assertEqual(Recording.spliced, [])
+    
+    @unittest.skipUnless(hasattr(os, 'splice'), 'os.splice is not available')
+    def test_only_captured_responses_are_decoded(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        sink = Sink(directory)
+        self.manipulator.load_many((Unzip(), Zip(), Capture((r'.*/gzip/captured',), sink=sink)))
+        self.assertBody(self.fetch('/gzip/other'), COMPRESSED)
+        self.assertEqual(Recording.spliced, [True])
+        self.assertBody(gzip.decompress(self.fetch('/gzip/captured')), BODY)
+        self.assertEqual(Recording.spliced, [True])
+        sink.shutdown()
+        captured = [os.path.join(root, name) for root, directories, files in os.walk(directory) for name in files]
+        self.assertEqual(len(captured), 1)
+        with open(captured[0], 'rb') as file:
+            self.assertBody(file.read(), BODY)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import argparse
+import platform
+import subprocess
+
+from loadgen import run
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+MODES = ('simple', 'async', 'prefork', 'prefork-async')
+ROUTES = {'htmlpage': '/', 'directory': '/data/test1', 'file': '/source.py'}
+
+def serve(mode, port, workers):
+    sys.path[:0] = [os.path.join(BASE, '..', 'src'), os.path.join(BASE, '..', 'examples')]
+    from example import Example
+    from pyweb.core import server
+    server.SendfileRequestHandler.log_message = lambda self, *args: None
+    if mode == 'simple':
+        server.simple_server(Example(), '127.0.0.1', port)
+    elif mode == 'async':
+        server.async_server(Example(), '127.0.0.1', port)
+    else:
+        server.prefork_server(Example(), '127.0.0.1', port, workers=workers,
+                              mode='async' if mode == 'prefork-async' else 'simple')
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_ready(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('server on port {} did not start'.format(port))
+
+def rss(pid):
+    pids = [pid]
+    if os.path.isdir('/proc'):
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open('/proc/{}/stat'.format(entry)) as stat:
+                        if int(stat.read().rsplit(')', 1)[1].split()[1]) == pid:
+                            pids.append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    pass
+    total = 0
+    for pid in pids:
+        try:
+            with open('/proc/{}/status'.format(pid)) as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            return None
+    return total or None
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def benchmark(mode, routes, concurrency, duration, workers, processes):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', mode,
+                                '--port', str(port), '--workers', str(workers)])
+    try:
+        wait_ready(port)
+        results = []
+        for name in routes:
+            run('127.0.0.1', port, ROUTES[name], concurrency, 1, processes)
+            result = run('127.0.0.1', port, ROUTES[name], concurrency, duration, processes)
+            result.update(mode=mode, route=name, path=ROUTES[name], rss=rss(process.pid))
+            results.append(result)
+            print('{mode:14} {route:10} {rps:10.1f} req/s  p50 {p50ms:7.2f} ms  p99 {p99ms:7.2f} ms  '
+                  'errors {errors}  rss {rssmb:.1f} MB'.format(p50ms=(result['p50'] or 0) * 1000,
+                                                              p99ms=(result['p99'] or 0) * 1000,
+                                                              rssmb=(result['rss'] or 0) / 2 ** 20,
+                                                              **result))
+        return results
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+def compare(old, new):
+    with open(old) as file:
+        before = {(result['mode'], result['route']): result for result in json.load(file)['results']}
+    with open(new) as file:
+        after = json.load(file)['results']
+    for result in after:
+        previous = before.get((result['mode'], result['route']))
+        if previous is None:
+            continue
+        change = (result['rps'] - previous['rps']) / previous['rps'] * 100 if previous['rps'] else 0
+        print('{:14} {:10} {:10.1f} -> {:10.1f} req/s ({:+.1f}%)  p99 {:.2f} -> {:.2f} ms'.format(
+            result['mode'], result['route'], previous['rps'], result['rps'], change,
+            (previous['p99'] or 0) * 1000, (result['p99'] or 0) * 1000))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pyweb Example application.')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--routes', default=','.join(ROUTES))
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--output')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--serve', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+    if arguments.serve:
+        return serve(arguments.serve, arguments.port, arguments.workers)
+    if arguments.compare:
+        return compare(*arguments.compare)
+    results = []
+    for mode in arguments.modes.split(','):
+        results.extend(benchmark(mode, arguments.routes.split(','), arguments.concurrency,
+                                 arguments.duration, arguments.workers, arguments.processes))
+    revision = commit()
+    output = arguments.output or os.path.join(BASE, 'results', '{}.json'.format(revision))
+    with open(output, 'w') as file:
+        json.dump({'commit': revision,
+                   'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'cpus': os.cpu_count(),
+                   'settings': {'concurrency': arguments.concurrency, 'duration': arguments.duration,
+                                'workers': arguments.workers, 'processes': arguments.processes},
+                   'results': results}, file, indent=2)
+    print('results written to {}'.format(output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import asyncio
+import multiprocessing
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('iso-8859-1').split('\r\n')
+    version, status = lines[0].split(' ', 2)[:2]
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+    size = 0
+    if 'content-length' in headers:
+        size = len(await reader.readexactly(int(headers['content-length'])))
+    elif headers.get('transfer-encoding') == 'chunked':
+        chunk = int((await reader.readline()).split(b';')[0], 16)
+        while chunk:
+            size += len(await reader.readexactly(chunk + 2)) - 2
+            chunk = int((await reader.readline()).split(b';')[0], 16)
+        await reader.readline()
+    else:
+        size = len(await reader.read())
+        return int(status), size, False
+    if version == 'HTTP/1.1':
+        keep_alive = headers.get('connection') != 'close'
+    else:
+        keep_alive = headers.get('connection') == 'keep-alive'
+    return int(status), size, keep_alive
+
+async def client(host, port, request, deadline, result):
+    reader = writer = None
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            status, size, keep_alive = await read_response(reader)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            result['errors'] += 1
+            keep_alive = False
+        else:
+            result['latencies'].append(time.perf_counter() - started)
+            result['bytes'] += size
+            if status >= 400:
+                result['errors'] += 1
+        if not keep_alive and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+async def load(host, port, path, concurrency, duration):
+    request = 'GET {} HTTP/1.1\r\nHost: {}:{}\r\n\r\n'.format(path, host, port).encode('iso-8859-1')
+    result = {'latencies': [], 'errors': 0, 'bytes': 0}
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*[client(host, port, request, deadline, result) for _ in range(concurrency)])
+    return result
+
+def _process(arguments):
+    return asyncio.run(load(*arguments))
+
+def run(host, port, path, concurrency=50, duration=10, processes=1):
+    started = time.perf_counter()
+    if processes > 1:
+        share = max(1, concurrency // processes)
+        with multiprocessing.Pool(processes) as pool:
+            parts = pool.map(_process, [(host, port, path, share, duration)] * processes)
+    else:
+        parts = [_process((host, port, path, concurrency, duration))]
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for part in parts for latency in part['latencies'])
+    return {'requests': len(latencies),
+            'errors': sum(part['errors'] for part in parts),
+            'bytes': sum(part['bytes'] for part in parts),
+            'seconds': elapsed,
+            'rps': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.50),
+            'p90': percentile(latencies, 0.90),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None}
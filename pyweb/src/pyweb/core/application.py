@@ -13,33 +13,99 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import re
-
-from collections import OrderedDict
+import time
+import asyncio
+import inspect
 
+from pyweb.core.cache import ResponseCache, CachedHandle, AsyncCachedHandle
+from pyweb.core.compression import compress_response
+from pyweb.core.metrics import Metrics
 from pyweb.core.request import Request
-from pyweb.core.response import Response
+from pyweb.core.response import Response, iterate_async
+from pyweb.core.router import Router
+
+def is_coroutine_handle(handle):
+    return (inspect.iscoroutinefunction(handle) or
+            inspect.iscoroutinefunction(getattr(handle, '__call__', None)))
 
 class Application():
     __URLS__ = {}
+    __COMPRESS__ = None
+    __CACHE_SIZE__ = 64 * 1024 * 1024
+    __METRICS__ = None
+    __PROFILE__ = 0.0
     def __init__(self):
-        self._urls = OrderedDict()
+        self.cache = ResponseCache(self.__CACHE_SIZE__)
+        self.metrics = None
+        self._labels = {}
+        routes = []
+        if self.__METRICS__ is not None or self.__PROFILE__:
+            self.metrics = Metrics(self.__PROFILE__)
+            if self.__METRICS__ is not None:
+                routes.append((self.__METRICS__, self.metrics.export))
+                self._labels[self.metrics.export] = 'metrics'
         for url, handle in self.__URLS__.items():
+            handle, options = (handle, {}) if isinstance(handle, str) else handle
             if hasattr(self, handle):
-                self._urls[re.compile(r'^({})$'.format(url))] = getattr(self, handle)
+                routes.append((url, self.route(handle, options)))
+                self._labels[routes[-1][1]] = handle
+        self._router = Router(routes)
     
-    def handle(self, environ, start_response):
+    def route(self, name, options):
+        handle = getattr(self, name)
+        if options.get('cache'):
+            if is_coroutine_handle(handle):
+                handle = AsyncCachedHandle(handle, self.cache, name, options['cache'])
+            else:
+                handle = CachedHandle(handle, self.cache, name, options['cache'])
+        return handle
+    
+    def dispatch(self, environ):
+        started = time.perf_counter()
         request = Request(environ, self)
         response = Response(self)
-        for url, handle in self._urls.items():
-            if url.match(request.path):
-                handle(request, response)  
-                start_response(*response.start_response)
-                return response.body
-        self.error(request, response)
+        handle = self._router.resolve(request.path)
+        if handle is None:
+            handle = self.error
+        try:
+            request.content_length
+        except ValueError:
+            handle = self.bad_request
+        if self.metrics is not None:
+            self.metrics.begin(request, self._labels.get(handle, 'error'), started)
+            handle = self.metrics.instrument(request, handle, is_coroutine_handle(handle))
+        return request, response, handle
+    
+    def handle(self, environ, start_response):
+        request, response, handle = self.dispatch(environ)
+        result = handle(request, response)
+        if asyncio.iscoroutine(result):
+            asyncio.run(result)
+        if hasattr(response.body, '__aiter__'):
+            response.body = iterate_async(response.body)
+        return self.finish(request, response, start_response)
+    
+    async def handle_async(self, environ, start_response, executor=None):
+        request, response, handle = self.dispatch(environ)
+        if is_coroutine_handle(handle):
+            await handle(request, response)
+        else:
+            await asyncio.get_running_loop().run_in_executor(executor, handle, request, response)
+        return self.finish(request, response, start_response)
+    
+    def finish(self, request, response, start_response):
+        if self.__COMPRESS__ is not None:
+            compress_response(request, response, self.__COMPRESS__)
+        if self.metrics is not None:
+            response.body = self.metrics.wrap(request, response)
         start_response(*response.start_response)
         return response.body
     
+    def bad_request(self, request, response):
+        response.status = 400
+        response.message = 'BAD REQUEST'
+        response.body.append('400 Bad Request...'.encode('utf-8'))
+    
     def error(self, request, response):
         response.status = 404
         response.message = 'NOT FOUND'
@@ -0,0 +1,206 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import asyncio
+import threading
+
+from collections import OrderedDict
+
+from pyweb.core.response import Headers
+
+UNCACHEABLE = ('no-store', 'no-cache', 'private')
+
+class Entry():
+    def __init__(self, name, path, status, message, headers, body, expires):
+        self.name = name
+        self.path = path
+        self.status = status
+        self.message = message
+        self.headers = headers
+        self.body = body
+        self.expires = expires
+        self.size = len(body) + sum(len(name) + len(value) for name, value in headers)
+    
+    def apply(self, response):
+        response.status = self.status
+        response.message = self.message
+        response.headers = Headers(self.headers)
+        response.body = [self.body]
+
+class ResponseCache():
+    def __init__(self, max_size=64 * 1024 * 1024, timeout=30):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._vary = {}
+        self._bases = {}
+        self._lock = threading.Lock()
+        self._pending = {}
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def base(self, name, request):
+        return name, request.path, request.environ.get('QUERY_STRING', '')
+    
+    def key(self, name, request):
+        base = self.base(name, request)
+        return base + tuple(request.headers.get(header) for header in self._vary.get(base, ()))
+    
+    def lookup(self, name, request, count=True):
+        key = self.key(name, request)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+            if count:
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        return entry
+    
+    def cacheable(self, response):
+        if response.status != 200 or not isinstance(response.body, list):
+            return False
+        if 'Set-Cookie' in response.headers or response.headers.get('Vary', '').strip() == '*':
+            return False
+        control = response.headers.get('Cache-Control', '').lower()
+        return not any(directive in control for directive in UNCACHEABLE)
+    
+    def store(self, name, request, response, ttl):
+        if not self.cacheable(response):
+            return None
+        vary = tuple(header.strip() for header in response.headers.get('Vary', '').split(',') if header.strip())
+        body = b''.join(response.body)
+        entry = Entry(name, request.path, response.status, response.message, list(response.headers.items()),
+                      body, time.monotonic() + ttl)
+        if entry.size > self.max_size:
+            return None
+        with self._lock:
+            base = self.base(name, request)
+            self._vary[base] = vary
+            key = self.key(name, request)
+            self._remove(key)
+            self._vary[base] = vary
+            self._bases[base] = self._bases.get(base, 0) + 1
+            self._entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        response.body = [body]
+        return entry
+    
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+            base = key[:3]
+            count = self._bases.pop(base) - 1
+            if count:
+                self._bases[base] = count
+            else:
+                del self._vary[base]
+    
+    def invalidate(self, name=None, path=None):
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if (name is None or entry.name == name) and (path is None or entry.path == path):
+                    self._remove(key)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vary.clear()
+            self._bases.clear()
+            self.size = 0
+    
+    def begin(self, key, factory):
+        with self._lock:
+            waiter = self._pending.get(key)
+            if waiter is None:
+                self._pending[key] = factory()
+            return waiter
+    
+    def end(self, key):
+        with self._lock:
+            waiter = self._pending.pop(key, None)
+        if waiter is not None:
+            waiter.set()
+
+class CachedHandle():
+    def __init__(self, handle, cache, name, ttl):
+        self.handle = handle
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+    
+    def __call__(self, request, response):
+        if request.method not in ('GET', 'HEAD'):
+            return self.handle(request, response)
+        entry = self.cache.lookup(self.name, request)
+        if entry is None:
+            key = self.cache.key(self.name, request)
+            waiter = self.cache.begin(key, threading.Event)
+            if waiter is not None:
+                waiter.wait(self.cache.timeout)
+                entry = self.cache.lookup(self.name, request, count=False)
+                if entry is not None:
+                    self.cache.coalesced += 1
+            if entry is None:
+                try:
+                    self.handle(request, response)
+                    self.cache.store(self.name, request, response, self.ttl)
+                finally:
+                    if waiter is None:
+                        self.cache.end(key)
+                return
+        entry.apply(response)
+
+class AsyncCachedHandle(CachedHandle):
+    async def __call__(self, request, response):
+        if request.method not in ('GET', 'HEAD'):
+            return await self.handle(request, response)
+        entry = self.cache.lookup(self.name, request)
+        if entry is None:
+            key = self.cache.key(self.name, request)
+            waiter = self.cache.begin(key, asyncio.Event)
+            if waiter is not None:
+                try:
+                    await asyncio.wait_for(waiter.wait(), self.cache.timeout)
+                except asyncio.TimeoutError:
+                    pass
+                entry = self.cache.lookup(self.name, request, count=False)
+                if entry is not None:
+                    self.cache.coalesced += 1
+            if entry is None:
+                try:
+                    await self.handle(request, response)
+                    self.cache.store(self.name, request, response, self.ttl)
+                finally:
+                    if waiter is None:
+                        self.cache.end(key)
+                return
+        entry.apply(response)
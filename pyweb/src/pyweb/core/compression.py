@@ -0,0 +1,121 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from pyweb.core.response import FileRange
+
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+COMPRESSIBLE = re.compile(r'^(text/|application/(json|javascript|xml|xhtml\+xml)|image/svg\+xml)')
+
+def accepted_encodings(header):
+    accepted = {}
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    return accepted
+
+def choose_encoding(header, available=ENCODINGS):
+    if not header:
+        return None
+    accepted = accepted_encodings(header)
+    best, quality = None, 0
+    for encoding in available:
+        if accepted.get(encoding, accepted.get('*', 0)) > quality:
+            best, quality = encoding, accepted.get(encoding, accepted.get('*', 0))
+    return best
+
+def compressor(encoding, level=6):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+def compress(data, encoding, level=6):
+    process, flush, finish = compressor(encoding, level)
+    return process(data) + finish()
+
+def compress_iter(body, encoding, level=6):
+    process, flush, finish = compressor(encoding, level)
+    try:
+        for data in body:
+            yield process(data) + flush()
+        yield finish()
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+async def compress_aiter(body, encoding, level=6):
+    process, flush, finish = compressor(encoding, level)
+    try:
+        async for data in body:
+            yield process(data) + flush()
+        yield finish()
+    finally:
+        if hasattr(body, 'aclose'):
+            await body.aclose()
+
+def add_vary(headers, value):
+    if 'Vary' not in headers:
+        headers['Vary'] = value
+    elif value.lower() not in headers['Vary'].lower():
+        headers.replace_header('Vary', '{}, {}'.format(headers['Vary'], value))
+
+def compress_response(request, response, min_size=1024, level=6):
+    headers = response.headers
+    if response.status != 200 or 'Content-Encoding' in headers or isinstance(response.body, FileRange):
+        return
+    if not COMPRESSIBLE.match(headers.get('Content-Type', '')):
+        return
+    if isinstance(response.body, list):
+        data = b''.join(response.body)
+        if len(data) < min_size:
+            return
+    elif 'Content-Length' in headers and int(headers['Content-Length']) < min_size:
+        return
+    add_vary(headers, 'Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return
+    del headers['Content-Length']
+    if isinstance(response.body, list):
+        response.body = [compress(data, encoding, level)]
+        headers['Content-Length'] = str(len(response.body[0]))
+    elif hasattr(response.body, '__aiter__'):
+        response.body = compress_aiter(response.body, encoding, level)
+    else:
+        response.body = compress_iter(response.body, encoding, level)
+    if 'ETag' in headers:
+        headers.replace_header('ETag', '{}-{}"'.format(headers['ETag'].rstrip('"'), encoding))
+    headers['Content-Encoding'] = encoding
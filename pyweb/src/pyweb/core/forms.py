@@ -0,0 +1,182 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+
+from urllib.parse import parse_qsl
+from tempfile import SpooledTemporaryFile
+
+OPTION = re.compile(r';\s*([\w.!#$%&\'*+^`|~-]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+
+PREAMBLE, DELIMITER, HEADERS, BODY, END = range(5)
+
+def parse_options_header(value):
+    value = value or ''
+    index = value.find(';')
+    if index < 0:
+        return value.strip().lower(), {}
+    options = {}
+    for name, option in OPTION.findall(value[index:]):
+        option = option.strip()
+        if option.startswith('"'):
+            option = re.sub(r'\\(.)', r'\1', option[1:-1])
+        options[name.lower()] = option
+    return value[:index].strip().lower(), options
+
+class Part():
+    def __init__(self, headers, spool_size=1024 * 1024, encoding='utf-8'):
+        self.headers = headers
+        self.encoding = encoding
+        disposition, options = parse_options_header(headers.get('content-disposition'))
+        self.name = options.get('name')
+        self.filename = options.get('filename')
+        self.content_type = headers.get('content-type', 'text/plain')
+        self.file = SpooledTemporaryFile(max_size=spool_size)
+        self.size = 0
+    
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+    
+    def finish(self):
+        self.file.seek(0)
+    
+    @property
+    def value(self):
+        self.file.seek(0)
+        return self.file.read().decode(self.encoding, 'replace')
+    
+    def close(self):
+        self.file.close()
+
+class MultipartParser():
+    def __init__(self, boundary, spool_size=1024 * 1024, max_header_size=16384, encoding='utf-8'):
+        self.delimiter = b'\r\n--' + boundary.encode('latin-1')
+        self.spool_size = spool_size
+        self.max_header_size = max_header_size
+        self.encoding = encoding
+        self.buffer = bytearray(b'\r\n')
+        self.state = PREAMBLE
+        self.part = None
+        self.parts = []
+    
+    def feed(self, data):
+        self.buffer += data
+        while self.step():
+            pass
+    
+    def step(self):
+        buffer = self.buffer
+        if self.state == PREAMBLE:
+            index = buffer.find(self.delimiter)
+            if index < 0:
+                del buffer[:max(0, len(buffer) - len(self.delimiter) + 1)]
+                return False
+            del buffer[:index + len(self.delimiter)]
+            self.state = DELIMITER
+        elif self.state == DELIMITER:
+            if len(buffer) < 2:
+                return False
+            if buffer.startswith(b'--'):
+                self.state = END
+                buffer.clear()
+                return False
+            index = buffer.find(b'\r\n')
+            if index < 0:
+                self.check_size()
+                return False
+            del buffer[:index + 2]
+            self.state = HEADERS
+        elif self.state == HEADERS:
+            if buffer.startswith(b'\r\n'):
+                index, block = 0, b''
+            else:
+                index = buffer.find(b'\r\n\r\n')
+                if index < 0:
+                    self.check_size()
+                    return False
+                block = bytes(buffer[:index])
+            del buffer[:index + 2 if not block else index + 4]
+            headers = {}
+            for line in block.decode(self.encoding, 'replace').split('\r\n'):
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            self.part = Part(headers, self.spool_size, self.encoding)
+            self.state = BODY
+        elif self.state == BODY:
+            index = buffer.find(self.delimiter)
+            if index < 0:
+                safe = len(buffer) - len(self.delimiter) + 1
+                if safe > 0:
+                    self.part.write(buffer[:safe])
+                    del buffer[:safe]
+                return False
+            self.part.write(buffer[:index])
+            del buffer[:index + len(self.delimiter)]
+            self.part.finish()
+            self.parts.append(self.part)
+            self.part = None
+            self.state = DELIMITER
+        else:
+            buffer.clear()
+            return False
+        return True
+    
+    def check_size(self):
+        if len(self.buffer) > self.max_header_size:
+            raise ValueError('multipart headers too large')
+    
+    def close(self):
+        if self.state != END:
+            raise ValueError('incomplete multipart body')
+        fields = {}
+        for part in self.parts:
+            fields.setdefault(part.name, []).append(part if part.filename is not None else part.value)
+        return fields
+
+class UrlencodedParser():
+    def __init__(self, max_size=1024 * 1024, encoding='utf-8'):
+        self.max_size = max_size
+        self.encoding = encoding
+        self.buffer = bytearray()
+        self.fields = {}
+        self.size = 0
+    
+    def feed(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise ValueError('form too large')
+        self.buffer += data
+        index = self.buffer.rfind(b'&')
+        if index >= 0:
+            self.parse(bytes(self.buffer[:index]))
+            del self.buffer[:index + 1]
+    
+    def parse(self, data):
+        for name, value in parse_qsl(data.decode(self.encoding, 'replace'), encoding=self.encoding):
+            self.fields.setdefault(name, []).append(value)
+    
+    def close(self):
+        self.parse(bytes(self.buffer))
+        self.buffer.clear()
+        return self.fields
+
+def form_parser(content_type, spool_size=1024 * 1024, max_size=1024 * 1024):
+    mimetype, options = parse_options_header(content_type)
+    if mimetype == 'application/x-www-form-urlencoded':
+        return UrlencodedParser(max_size)
+    if mimetype == 'multipart/form-data' and options.get('boundary'):
+        return MultipartParser(options['boundary'], spool_size)
+    return None
@@ -0,0 +1,243 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import sys
+import time
+import pstats
+import random
+import cProfile
+import threading
+
+from pyweb.core.response import FileRange
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('route', 'handler', 'body', 'total')
+
+class Histogram():
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+    
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield ('+Inf' if bound == float('inf') else repr(bound)), total
+
+class RouteMetrics():
+    def __init__(self, buckets=BUCKETS):
+        self.in_flight = 0
+        self.bytes_sent = 0
+        self.statuses = {}
+        self.durations = {phase: Histogram(buckets) for phase in PHASES}
+        self.profile = None
+        self.profiled = 0.0
+
+class MeteredBody():
+    def __init__(self, body, metrics, request):
+        self.body = body
+        self.metrics = metrics
+        self.request = request
+        self.size = 0
+        self.started = time.perf_counter()
+    
+    def __iter__(self):
+        for data in self.body:
+            self.size += len(data)
+            yield data
+    
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.metrics.end(self.request, self.size, time.perf_counter() - self.started)
+
+class AsyncMeteredBody():
+    def __init__(self, body, metrics, request):
+        self.body = body
+        self.metrics = metrics
+        self.request = request
+        self.size = 0
+        self.started = time.perf_counter()
+    
+    async def __aiter__(self):
+        async for data in self.body:
+            self.size += len(data)
+            yield data
+    
+    async def aclose(self):
+        try:
+            if hasattr(self.body, 'aclose'):
+                await self.body.aclose()
+        finally:
+            self.metrics.end(self.request, self.size, time.perf_counter() - self.started)
+
+class Metrics():
+    def __init__(self, sample=0.0, buckets=BUCKETS, prefix='pyweb'):
+        self.sample = sample
+        self.buckets = buckets
+        self.prefix = prefix
+        self.routes = {}
+        self._lock = threading.Lock()
+        self._profiling = threading.Lock()
+    
+    def route(self, name):
+        metrics = self.routes.get(name)
+        if metrics is None:
+            with self._lock:
+                metrics = self.routes.setdefault(name, RouteMetrics(self.buckets))
+        return metrics
+    
+    def begin(self, request, name, started):
+        request.route = name
+        request.started = started
+        metrics = self.route(name)
+        with self._lock:
+            metrics.in_flight += 1
+            metrics.durations['route'].observe(time.perf_counter() - started)
+    
+    def instrument(self, request, handle, coroutine=False):
+        metrics = self.route(request.route)
+        def record(profiler, started):
+            elapsed = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+                with self._lock:
+                    if metrics.profile is None:
+                        metrics.profile = pstats.Stats(profiler)
+                    else:
+                        metrics.profile.add(profiler)
+                    metrics.profiled += elapsed
+                self._profiling.release()
+            with self._lock:
+                metrics.durations['handler'].observe(elapsed)
+        def profiler():
+            if self.sample and random.random() < self.sample and self._profiling.acquire(False):
+                profiler = cProfile.Profile()
+                profiler.enable()
+                return profiler
+            return None
+        if coroutine:
+            async def instrumented(request, response):
+                started, active = time.perf_counter(), profiler()
+                try:
+                    return await handle(request, response)
+                except Exception:
+                    self.fail(request)
+                    raise
+                finally:
+                    record(active, started)
+        else:
+            def instrumented(request, response):
+                started, active = time.perf_counter(), profiler()
+                try:
+                    return handle(request, response)
+                except Exception:
+                    self.fail(request)
+                    raise
+                finally:
+                    record(active, started)
+        return instrumented
+    
+    def wrap(self, request, response):
+        metrics = self.route(request.route)
+        with self._lock:
+            metrics.statuses[response.status] = metrics.statuses.get(response.status, 0) + 1
+        body = response.body
+        if isinstance(body, list):
+            self.end(request, sum(len(data) for data in body), 0.0)
+        elif isinstance(body, FileRange):
+            self.end(request, body.count, 0.0)
+        elif hasattr(body, '__aiter__'):
+            return AsyncMeteredBody(body, self, request)
+        else:
+            return MeteredBody(body, self, request)
+        return body
+    
+    def fail(self, request):
+        metrics = self.route(request.route)
+        with self._lock:
+            metrics.statuses[500] = metrics.statuses.get(500, 0) + 1
+        self.end(request, 0, 0.0)
+    
+    def end(self, request, size, elapsed):
+        metrics = self.route(request.route)
+        with self._lock:
+            metrics.in_flight -= 1
+            metrics.bytes_sent += size
+            metrics.durations['body'].observe(elapsed)
+            metrics.durations['total'].observe(time.perf_counter() - request.started)
+    
+    def export(self, request, response):
+        response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        response.body.append(self.exposition().encode('utf-8'))
+    
+    def exposition(self):
+        prefix = self.prefix
+        lines = ['# HELP {}_requests_total Requests handled per route and status.'.format(prefix),
+                 '# TYPE {}_requests_total counter'.format(prefix)]
+        with self._lock:
+            routes = sorted(self.routes.items())
+            for name, metrics in routes:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append('{}_requests_total{{route="{}",status="{}"}} {}'.format(prefix, name, status, count))
+            lines.append('# HELP {}_requests_in_flight Requests currently being handled.'.format(prefix))
+            lines.append('# TYPE {}_requests_in_flight gauge'.format(prefix))
+            for name, metrics in routes:
+                lines.append('{}_requests_in_flight{{route="{}"}} {}'.format(prefix, name, metrics.in_flight))
+            lines.append('# HELP {}_response_bytes_total Response body bytes sent.'.format(prefix))
+            lines.append('# TYPE {}_response_bytes_total counter'.format(prefix))
+            for name, metrics in routes:
+                lines.append('{}_response_bytes_total{{route="{}"}} {}'.format(prefix, name, metrics.bytes_sent))
+            lines.append('# HELP {}_request_duration_seconds Time spent per request phase.'.format(prefix))
+            lines.append('# TYPE {}_request_duration_seconds histogram'.format(prefix))
+            for name, metrics in routes:
+                for phase in PHASES:
+                    histogram = metrics.durations[phase]
+                    labels = 'route="{}",phase="{}"'.format(name, phase)
+                    for bound, count in histogram.cumulative():
+                        lines.append('{}_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(prefix, labels,
+                                                                                                 bound, count))
+                    lines.append('{}_request_duration_seconds_sum{{{}}} {}'.format(prefix, labels, histogram.sum))
+                    lines.append('{}_request_duration_seconds_count{{{}}} {}'.format(prefix, labels,
+                                                                                    histogram.count))
+        return '\n'.join(lines) + '\n'
+    
+    def dump_profile(self, file=None, limit=20):
+        file = sys.stderr if file is None else file
+        with self._lock:
+            profiled = sorted(((metrics.profiled, name, metrics.profile) for name, metrics in self.routes.items()
+                               if metrics.profile is not None), key=lambda item: item[0], reverse=True)
+            for elapsed, name, profile in profiled:
+                print('==== {} ({:.3f}s sampled) ===='.format(name, elapsed), file=file)
+                profile.stream = file
+                profile.sort_stats('cumulative').print_stats(limit)
+    
+    def profile_report(self, limit=20):
+        stream = io.StringIO()
+        self.dump_profile(stream, limit)
+        return stream.getvalue()
@@ -13,25 +13,118 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from http.client import HTTPMessage
-from urllib.parse import urlparse, parse_qs
+import re
 
-class Headers(HTTPMessage):
+from functools import cached_property
+from http.cookies import SimpleCookie
+from collections.abc import Mapping
+from urllib.parse import parse_qs
+
+from pyweb.core.forms import form_parser
+
+CHUNK_SIZE = re.compile(rb'[0-9A-Fa-f]+')
+
+def parse_length(value):
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError('invalid Content-Length {!r}'.format(value))
+    return int(value)
+
+def parse_chunk_size(line):
+    size = line.split(b';', 1)[0].rstrip(b' \t\r\n')
+    if not CHUNK_SIZE.fullmatch(size):
+        raise ValueError('invalid chunk size {!r}'.format(line))
+    return int(size, 16)
+
+class Headers(Mapping):
     CGI_HEADERS = ('CONTENT_TYPE', 'CONTENT_LENGTH')
     def __init__(self, environ):
-        super().__init__()
         self.environ = environ
-        for key, value in self.environ.items():
+    
+    def __getitem__(self, name):
+        key = name.upper().replace('-', '_')
+        if key not in self.CGI_HEADERS:
+            key = 'HTTP_' + key
+        return self.environ[key]
+    
+    def __iter__(self):
+        for key in self.environ:
             if key.startswith('HTTP_'):
-                self['-'.join([part.capitalize() for part in key[5:].split('_')])] = value
+                yield '-'.join([part.capitalize() for part in key[5:].split('_')])
             elif key in self.CGI_HEADERS:
-                self['-'.join([part.capitalize() for part in key[5:].split('_')])] = value
+                yield '-'.join([part.capitalize() for part in key.split('_')])
+    
+    def __len__(self):
+        return sum(1 for name in self)
 
 class Request():
+    SPOOL_SIZE = 1024 * 1024
+    MAX_FORM_SIZE = 1024 * 1024
     def __init__(self, environ, application):
         self.environ = environ
         self.application = application
-        self.headers = Headers(environ)
         self.path = self.environ.get('PATH_INFO', '/')
-        self.query = parse_qs(self.environ.get('QUERY_STRING', ''))
         self.method = self.environ.get('REQUEST_METHOD', 'GET').upper()
+    
+    @cached_property
+    def headers(self):
+        return Headers(self.environ)
+    
+    @cached_property
+    def query(self):
+        return parse_qs(self.environ.get('QUERY_STRING', ''))
+    
+    @cached_property
+    def cookies(self):
+        cookies = SimpleCookie()
+        cookies.load(self.environ.get('HTTP_COOKIE', ''))
+        return {name: morsel.value for name, morsel in cookies.items()}
+    
+    @property
+    def content_length(self):
+        length = self.environ.get('CONTENT_LENGTH')
+        return parse_length(length) if length else None
+    
+    def stream(self, blocksize=65536):
+        input = self.environ['wsgi.input']
+        remaining = self.content_length
+        if remaining is None and not self.environ.get('wsgi.input_terminated'):
+            return
+        while remaining is None or remaining > 0:
+            data = input.read(blocksize if remaining is None else min(blocksize, remaining))
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
+    
+    async def stream_async(self, blocksize=65536):
+        input = self.environ['wsgi.input']
+        if not hasattr(input, 'aread'):
+            for data in self.stream(blocksize):
+                yield data
+            return
+        data = await input.aread(blocksize)
+        while data:
+            yield data
+            data = await input.aread(blocksize)
+    
+    def _form_parser(self):
+        return form_parser(self.environ.get('CONTENT_TYPE'), self.SPOOL_SIZE, self.MAX_FORM_SIZE)
+    
+    @cached_property
+    def form(self):
+        parser = self._form_parser()
+        if parser is None:
+            return {}
+        for data in self.stream():
+            parser.feed(data)
+        return parser.close()
+    
+    async def read_form(self):
+        if 'form' not in self.__dict__:
+            parser = self._form_parser()
+            if parser is not None:
+                async for data in self.stream_async():
+                    parser.feed(data)
+            self.__dict__['form'] = {} if parser is None else parser.close()
+        return self.form
@@ -13,6 +13,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import asyncio
+
 from http.client import HTTPMessage
 
 class Headers(HTTPMessage):
@@ -25,6 +28,45 @@ class Headers(HTTPMessage):
     def response(self):
         return list(self.items())
     
+def iterate_async(body):
+    loop = asyncio.new_event_loop()
+    iterator = body.__aiter__()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(iterator.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        if hasattr(iterator, 'aclose'):
+            loop.run_until_complete(iterator.aclose())
+        loop.close()
+
+class FileRange():
+    def __init__(self, file, offset=0, count=None, blocksize=65536):
+        self.file = file
+        self.offset = offset
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - offset
+        self.count = count
+        self.blocksize = blocksize
+    
+    def __iter__(self):
+        self.file.seek(self.offset)
+        remaining = self.count
+        while remaining > 0:
+            data = self.file.read(min(self.blocksize, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    
+    def fileno(self):
+        return self.file.fileno()
+    
+    def close(self):
+        self.file.close()
+
 class Response():
     def __init__(self, application, body=None, headers=None):
         self.application = application
@@ -0,0 +1,72 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+
+from functools import lru_cache
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+def literal_prefix(url):
+    prefix = []
+    for op, av in sre_parse.parse(r'({})'.format(url))[0][1][-1]:
+        if op is not sre_parse.LITERAL:
+            break
+        prefix.append(chr(av))
+    return ''.join(prefix)
+
+class Router():
+    def __init__(self, routes=(), cache_size=4096):
+        self.cache_size = cache_size
+        self._routes = []
+        self._trie = {}
+        for url, handle in routes:
+            self._insert(url, handle)
+        self._reset()
+    
+    def add(self, url, handle):
+        self._insert(url, handle)
+        self._reset()
+    
+    def _insert(self, url, handle):
+        index = len(self._routes)
+        self._routes.append((re.compile(r'^({})$'.format(url)), handle))
+        node = self._trie
+        for char in literal_prefix(url):
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(index)
+    
+    def _reset(self):
+        self.resolve = lru_cache(maxsize=self.cache_size)(self._resolve)
+    
+    def _resolve(self, path):
+        node = self._trie
+        candidates = list(node.get(None, ()))
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            candidates.extend(node.get(None, ()))
+        for index in sorted(candidates):
+            url, handle = self._routes[index]
+            if url.match(path):
+                return handle
+        return None
+    
+    def __len__(self):
+        return len(self._routes)
@@ -13,8 +13,479 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from wsgiref.simple_server import make_server
+import os
+import sys
+import time
+import signal
+import socket
+import asyncio
+import threading
+import traceback
+
+from urllib.parse import unquote
+from email.utils import formatdate
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler, ServerHandler
+
+from pyweb.core.request import parse_length, parse_chunk_size
+from pyweb.core.response import FileRange
+
+SERVER_SOFTWARE = 'pyweb/0.1'
+
+class SendfileServerHandler(ServerHandler):
+    def result_is_file(self):
+        return isinstance(self.result, FileRange)
+    
+    def sendfile(self):
+        if not self.headers_sent:
+            self.send_headers()
+        self._flush()
+        if self.environ['REQUEST_METHOD'] == 'HEAD':
+            return True
+        connection = self.request_handler.connection
+        offset, remaining = self.result.offset, self.result.count
+        while remaining > 0:
+            sent = os.sendfile(connection.fileno(), self.result.fileno(), offset, remaining)
+            if not sent:
+                break
+            offset += sent
+            remaining -= sent
+            self.bytes_sent += sent
+        return True
+
+class SendfileRequestHandler(WSGIRequestHandler):
+    def handle(self):
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+        handler = SendfileServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+                                        multithread=False)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
 
 def simple_server(application, host='', port=8080):
-    server = make_server(host, port, application.handle)
+    server = make_server(host, port, application.handle, handler_class=SendfileRequestHandler)
     server.serve_forever()
+
+class StreamInput():
+    def __init__(self, reader, writer, length=0, chunked=False, expect=False, discard_limit=65536):
+        self.reader = reader
+        self.writer = writer
+        self.remaining = length
+        self.chunked = chunked
+        self.expect = expect
+        self.discard_limit = discard_limit
+        self.finished = not chunked and not length
+        self.malformed = False
+        self.loop = asyncio.get_running_loop()
+    
+    async def _read(self, size):
+        if self.finished:
+            return b''
+        if self.expect:
+            self.expect = False
+            self.writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        if self.chunked and not self.remaining:
+            line = await self.reader.readline()
+            try:
+                self.remaining = parse_chunk_size(line)
+            except ValueError:
+                self.malformed = True
+                raise ConnectionError('invalid chunk size')
+            if not self.remaining:
+                while (await self.reader.readline()).strip():
+                    pass
+                self.finished = True
+                return b''
+        data = await self.reader.read(min(size, self.remaining))
+        if not data:
+            raise ConnectionError('client closed connection')
+        self.remaining -= len(data)
+        if not self.remaining:
+            if self.chunked:
+                await self.reader.readexactly(2)
+            else:
+                self.finished = True
+        return data
+    
+    async def aread(self, size=-1):
+        chunks = []
+        while size < 0 or size > 0:
+            data = await self._read(65536 if size < 0 else size)
+            if not data:
+                break
+            chunks.append(data)
+            if size > 0:
+                size -= len(data)
+        return b''.join(chunks)
+    
+    async def areadline(self, limit=-1):
+        line = bytearray()
+        while not line.endswith(b'\n') and (limit < 0 or len(line) < limit):
+            data = await self._read(1)
+            if not data:
+                break
+            line += data
+        return bytes(line)
+    
+    async def discard(self):
+        if self.malformed:
+            return False
+        if self.expect:
+            return self.finished
+        discarded = 0
+        while not self.finished and discarded < self.discard_limit:
+            discarded += len(await self._read(65536))
+        return self.finished
+    
+    def _call(self, coroutine):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+        coroutine.close()
+        raise RuntimeError('use aread() from coroutines running on the event loop')
+    
+    def read(self, size=-1):
+        return self._call(self.aread(-1 if size is None else size))
+    
+    def readline(self, limit=-1):
+        return self._call(self.areadline(-1 if limit is None else limit))
+    
+    def readlines(self, hint=-1):
+        return list(self)
+    
+    def __iter__(self):
+        line = self.readline()
+        while line:
+            yield line
+            line = self.readline()
+
+class AsyncServer():
+    def __init__(self, application, host='', port=8080, executor=None, keep_alive=15, backlog=1024,
+                 sock=None):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor() if executor is None else executor
+        self.keep_alive = keep_alive
+        self.backlog = backlog
+        self.sock = sock
+        self.server = None
+        self.closing = False
+        self.connections = {}
+    
+    async def start(self):
+        if self.sock is None:
+            self.server = await asyncio.start_server(self.connection, self.host or None, self.port,
+                                                     backlog=self.backlog)
+        else:
+            self.server = await asyncio.start_server(self.connection, sock=self.sock,
+                                                     backlog=self.backlog)
+        self.finished = asyncio.Event()
+        return self.server
+    
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        await self.finished.wait()
+    
+    async def shutdown(self):
+        self.closing = True
+        self.server.close()
+        for task, busy in list(self.connections.items()):
+            if not busy:
+                task.cancel()
+        while self.connections:
+            await asyncio.sleep(0.1)
+        self.finished.set()
+    
+    async def connection(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        task = asyncio.current_task()
+        self.connections[task] = False
+        try:
+            while not self.closing and await self.request(reader, writer):
+                self.connections[task] = False
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError,
+                asyncio.CancelledError):
+            pass
+        finally:
+            del self.connections[task]
+            writer.close()
+    
+    async def request(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keep_alive)
+            self.connections[asyncio.current_task()] = True
+        except asyncio.LimitOverrunError:
+            writer.write(b'HTTP/1.1 431 Request Header Fields Too Large\r\nConnection: close\r\n\r\n')
+            return False
+        try:
+            environ, keep_alive = self.environ(head, writer)
+        except ValueError:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n')
+            return False
+        chunked = 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower()
+        if chunked:
+            environ.pop('CONTENT_LENGTH', None)
+        try:
+            length = 0 if chunked else parse_length(environ.get('CONTENT_LENGTH') or '0')
+        except ValueError:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n')
+            return False
+        expect = environ.get('HTTP_EXPECT', '').lower() == '100-continue'
+        input = StreamInput(reader, writer, length, chunked, expect)
+        environ['wsgi.input'] = input
+        environ['wsgi.input_terminated'] = True
+        started = []
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+        try:
+            body = await self.application.handle_async(environ, start_response, self.executor)
+        except Exception:
+            if input.malformed:
+                started[:] = ['400 BAD REQUEST', [('Content-Type', 'text/plain')]]
+                body = [b'400 Bad Request...']
+                keep_alive = False
+            else:
+                traceback.print_exc()
+                started[:] = ['500 INTERNAL SERVER ERROR', [('Content-Type', 'text/plain')]]
+                body = [b'500 Internal Server Error...']
+        try:
+            keep_alive = await self.respond(writer, environ, keep_alive, started[0], started[1], body)
+        finally:
+            if hasattr(body, '__aiter__') and callable(getattr(body, 'aclose', None)):
+                await body.aclose()
+            elif callable(getattr(body, 'close', None)):
+                body.close()
+        return keep_alive and await input.discard()
+    
+    async def respond(self, writer, environ, keep_alive, status, headers, body):
+        names = {name.lower() for name, value in headers}
+        bodiless = environ['REQUEST_METHOD'] == 'HEAD' or status.startswith(('1', '204', '304'))
+        chunked = False
+        if 'content-length' not in names and not status.startswith(('1', '204', '304')):
+            if isinstance(body, list):
+                headers.append(('Content-Length', str(sum(len(data) for data in body))))
+            elif environ['SERVER_PROTOCOL'] == 'HTTP/1.1':
+                chunked = True
+                headers.append(('Transfer-Encoding', 'chunked'))
+            else:
+                keep_alive = False
+        if 'date' not in names:
+            headers.append(('Date', formatdate(usegmt=True)))
+        if 'server' not in names:
+            headers.append(('Server', SERVER_SOFTWARE))
+        keep_alive = keep_alive and not self.closing
+        headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+        lines = ['{} {}'.format(environ['SERVER_PROTOCOL'], status)]
+        lines.extend('{}: {}'.format(name, value) for name, value in headers)
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('iso-8859-1')
+        if bodiless:
+            writer.write(head)
+        elif isinstance(body, list):
+            writer.writelines([head] + body)
+        else:
+            writer.write(head)
+            if isinstance(body, FileRange):
+                if body.count > 0:
+                    await writer.drain()
+                    await asyncio.get_running_loop().sendfile(writer.transport, body.file, body.offset,
+                                                              body.count)
+            elif hasattr(body, '__aiter__'):
+                async for data in body:
+                    self.write(writer, data, chunked)
+                    await writer.drain()
+            else:
+                await self.write_iterable(writer, body, chunked)
+            if chunked:
+                writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return keep_alive
+    
+    def write(self, writer, data, chunked):
+        if not data:
+            return
+        if chunked:
+            writer.writelines((b'%x\r\n' % len(data), data, b'\r\n'))
+        else:
+            writer.write(data)
+    
+    async def write_iterable(self, writer, body, chunked=False):
+        await writer.drain()
+        loop = asyncio.get_running_loop()
+        iterator = iter(body)
+        data = await loop.run_in_executor(self.executor, next, iterator, None)
+        while data is not None:
+            self.write(writer, data, chunked)
+            await writer.drain()
+            data = await loop.run_in_executor(self.executor, next, iterator, None)
+    
+    def environ(self, head, writer):
+        lines = head.decode('iso-8859-1').split('\r\n')
+        method, target, protocol = lines[0].split(' ')
+        if not protocol.startswith('HTTP/'):
+            raise ValueError(protocol)
+        path, _, query = target.partition('?')
+        sockname = writer.get_extra_info('sockname') or ('', self.port)
+        peername = writer.get_extra_info('peername') or ('', 0)
+        environ = {'REQUEST_METHOD': method.upper(),
+                   'SCRIPT_NAME': '',
+                   'PATH_INFO': unquote(path, 'iso-8859-1'),
+                   'QUERY_STRING': query,
+                   'SERVER_NAME': str(sockname[0]),
+                   'SERVER_PORT': str(sockname[1]),
+                   'SERVER_PROTOCOL': protocol,
+                   'SERVER_SOFTWARE': SERVER_SOFTWARE,
+                   'REMOTE_ADDR': str(peername[0]),
+                   'wsgi.version': (1, 0),
+                   'wsgi.url_scheme': 'http',
+                   'wsgi.errors': sys.stderr,
+                   'wsgi.multithread': True,
+                   'wsgi.multiprocess': False,
+                   'wsgi.run_once': False}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, value = line.split(':', 1)
+            key = name.strip().upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            value = value.strip()
+            environ[key] = environ[key] + ',' + value if key in environ else value
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        if protocol == 'HTTP/1.1':
+            keep_alive = 'close' not in connection
+        else:
+            keep_alive = 'keep-alive' in connection
+        return environ, keep_alive
+
+async def _serve_async(server):
+    await server.start()
+    if threading.current_thread() is threading.main_thread():
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, lambda: asyncio.ensure_future(server.shutdown()))
+    await server.serve_forever()
+
+def async_server(application, host='', port=8080, executor=None):
+    asyncio.run(_serve_async(AsyncServer(application, host, port, executor)))
+
+class SocketWSGIServer(WSGIServer):
+    def __init__(self, sock):
+        self.listener = sock
+        super().__init__(sock.getsockname()[:2], SendfileRequestHandler)
+    
+    def server_bind(self):
+        self.socket.close()
+        self.socket = self.listener
+        self.server_address = self.socket.getsockname()
+        host, port = self.server_address[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.setup_environ()
+    
+    def server_activate(self):
+        pass
+
+class PreforkServer():
+    def __init__(self, application, host='', port=8080, workers=None, reuse_port=False,
+                 mode='simple', timeout=30, backlog=1024):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.reuse_port = reuse_port
+        self.mode = mode
+        self.timeout = timeout
+        self.backlog = backlog
+        self.socket = None if reuse_port else self.bind()
+        self.children = {}
+        self.running = False
+    
+    def bind(self):
+        return socket.create_server((self.host, self.port), backlog=self.backlog,
+                                    reuse_port=self.reuse_port)
+    
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.monotonic()
+            return pid
+        status = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            self.worker(self.socket or self.bind())
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stderr.flush()
+            os._exit(status)
+    
+    def worker(self, sock):
+        if self.mode == 'async':
+            asyncio.run(_serve_async(AsyncServer(self.application, sock=sock, backlog=self.backlog)))
+        else:
+            server = SocketWSGIServer(sock)
+            server.set_app(self.application.handle)
+            signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+            server.serve_forever()
+            server.server_close()
+    
+    def stop(self, signum=None, frame=None):
+        self.running = False
+    
+    def serve_forever(self):
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        while self.running:
+            self.reap(self.respawn)
+            time.sleep(0.5)
+        self.drain()
+    
+    def reap(self, callback=None):
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                break
+            started = self.children.pop(pid)
+            if callback is not None:
+                callback(pid, status, started)
+    
+    def respawn(self, pid, status, started):
+        print('worker {} exited with status {}, restarting'.format(pid, status), file=sys.stderr)
+        if time.monotonic() - started < 1:
+            time.sleep(1)
+        if self.running:
+            self.spawn()
+    
+    def drain(self):
+        for pid in self.children:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.timeout
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            del self.children[pid]
+        if self.socket is not None:
+            self.socket.close()
+
+def prefork_server(application, host='', port=8080, workers=None, reuse_port=False, mode='simple'):
+    PreforkServer(application, host, port, workers, reuse_port, mode).serve_forever()
@@ -13,29 +13,62 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import os.path
-import mimetypes
-from wsgiref.util import FileWrapper
+import os
+import stat
+
+from pyweb.core.compression import SUFFIXES, add_vary, choose_encoding
+from pyweb.handlers.file import wrap_file
+from pyweb.handlers.metadata import Metadata, MetadataCache
 
 class Directory():
-    def __init__(self, root):
+    def __init__(self, root, cache_size=1024, inotify=True, etag='weak', cache_control=None,
+                 precompressed=True):
         self.root = os.path.abspath(root)
+        self.etag = etag
+        self.cache_control = cache_control
+        self.precompressed = precompressed
+        self.cache = MetadataCache(cache_size, inotify, self.root)
     
     def __call__(self, request, response):
         document = os.path.abspath(os.path.join(self.root, self.update_path(request.path)))
-        if os.path.isdir(document):
-            document = os.path.join(document, 'index.html')
-        if document.startswith(self.root) and os.path.isfile(document):
-            mimetype = mimetypes.guess_type(document)[0]
-            if mimetype:
-                response.headers['Content-Type'] = mimetype
-            response.headers['Content-Length'] = str(os.path.getsize(document))
-            response.body = FileWrapper(open(document, 'rb'))
-        else:
-            response.headers['Content-Type'] = 'text/html; charset=UTF-8'
-            response.status = 404
-            response.message = 'NOT FOUND'
-            response.body.append('<span style="font-size:50px"><b>404 Not Found</b></span>'.encode('utf-8'))
+        metadata = self.cache.get(document, self.resolve) if document.startswith(self.root) else None
+        if metadata is not None and metadata.variants:
+            add_vary(response.headers, 'Accept-Encoding')
+            encoding = choose_encoding(request.headers.get('Accept-Encoding'), metadata.variants)
+            if encoding is not None:
+                metadata = metadata.variants[encoding]
+        if metadata is not None:
+            try:
+                wrap_file(metadata.path, response, request=request, metadata=metadata)
+                return
+            except OSError:
+                self.cache.invalidate(document)
+        response.headers['Content-Type'] = 'text/html; charset=UTF-8'
+        response.status = 404
+        response.message = 'NOT FOUND'
+        response.body.append('<span style="font-size:50px"><b>404 Not Found</b></span>'.encode('utf-8'))
+    
+    def resolve(self, document):
+        try:
+            result = os.stat(document)
+            if stat.S_ISDIR(result.st_mode):
+                document = os.path.join(document, 'index.html')
+                result = os.stat(document)
+        except OSError:
+            return None
+        if not stat.S_ISREG(result.st_mode):
+            return None
+        metadata = Metadata(document, result, etag=self.etag, cache_control=self.cache_control)
+        if self.precompressed:
+            for encoding, suffix in SUFFIXES.items():
+                try:
+                    variant = os.stat(document + suffix)
+                except OSError:
+                    continue
+                if stat.S_ISREG(variant.st_mode):
+                    metadata.variants[encoding] = Metadata(document + suffix, variant, metadata.type,
+                                                           self.etag, self.cache_control, encoding)
+        return metadata
     
     def update_path(self, path):
         return path[1:]
\ No newline at end of file
@@ -13,19 +13,102 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import os.path
-import mimetypes
-from wsgiref.util import FileWrapper
+import os
+
+from email.utils import parsedate_to_datetime
+
+from pyweb.core.response import FileRange
+from pyweb.handlers.metadata import Metadata
 
 class File():
-    def __init__(self, path, type=None):
+    def __init__(self, path, type=None, etag='weak', cache_control=None):
         self.type = type
         self.path = path
+        self.etag = etag
+        self.cache_control = cache_control
+        self.metadata = None
             
     def __call__(self, request, response):
-        wrap_file(self.path, response, self.type)
-        
-def wrap_file(path, response, type=None):
-    response.headers['Content-Type'] = mimetypes.guess_type(path)[0] if type is None else type
-    response.headers['Content-Length'] = str(os.path.getsize(path))
-    response.body = FileWrapper(open(path, 'rb'))
\ No newline at end of file
+        stat = os.stat(self.path)
+        if self.metadata is None or self.metadata.changed(stat):
+            self.metadata = Metadata(self.path, stat, self.type, self.etag, self.cache_control)
+        wrap_file(self.path, response, request=request, metadata=self.metadata)
+
+def match_etag(header, etag, weak=True):
+    if etag is None:
+        return False
+    if header.strip() == '*':
+        return True
+    if not weak:
+        return not etag.startswith('W/') and etag in (tag.strip() for tag in header.split(','))
+    return etag.replace('W/', '', 1) in (tag.strip().replace('W/', '', 1) for tag in header.split(','))
+
+def modified_since(header, metadata):
+    try:
+        return metadata.mtime // 1000000000 > parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return True
+
+def not_modified(request, metadata):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if 'If-None-Match' in request.headers:
+        return match_etag(request.headers['If-None-Match'], metadata.etag)
+    if 'If-Modified-Since' in request.headers:
+        return not modified_since(request.headers['If-Modified-Since'], metadata)
+    return False
+
+def range_applies(request, metadata):
+    if 'If-Range' not in request.headers:
+        return True
+    condition = request.headers['If-Range'].strip()
+    if condition.startswith(('"', 'W/')):
+        return match_etag(condition, metadata.etag, weak=False)
+    return condition == metadata.last_modified
+
+def parse_range(header, size):
+    unit, _, ranges = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return None
+    first, _, last = ranges.strip().partition('-')
+    try:
+        if not first:
+            start, end = max(size - int(last), 0), size
+        else:
+            start, end = int(first), min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= end:
+        raise ValueError('range not satisfiable')
+    return start, end
+
+def wrap_file(path, response, type=None, request=None, metadata=None):
+    if metadata is None:
+        metadata = Metadata.load(path, type)
+    if request is not None and not_modified(request, metadata):
+        response.status = 304
+        response.message = 'NOT MODIFIED'
+        for name, value in metadata.validators:
+            response.headers[name] = value
+        return
+    file = open(path, 'rb')
+    for name, value in metadata.headers:
+        response.headers[name] = value
+    size = metadata.size
+    start, end = 0, size
+    if request is not None and 'Range' in request.headers and range_applies(request, metadata):
+        try:
+            start, end = parse_range(request.headers['Range'], size) or (0, size)
+        except ValueError:
+            response.status = 416
+            response.message = 'RANGE NOT SATISFIABLE'
+            response.headers['Content-Range'] = 'bytes */{}'.format(size)
+            response.headers['Content-Length'] = '0'
+            file.close()
+            return
+        if (start, end) != (0, size):
+            response.status = 206
+            response.message = 'PARTIAL CONTENT'
+            response.headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end - 1, size)
+    response.headers['Content-Length'] = str(end - start)
+    response.body = FileRange(file, start, end - start)
\ No newline at end of file
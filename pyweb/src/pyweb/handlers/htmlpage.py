@@ -13,12 +13,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from pyweb.core.compression import ENCODINGS, choose_encoding, compress
+
 class HtmlPage():
-    def __init__(self, html):
+    def __init__(self, html, min_size=256):
         self.html = html.encode('utf-8')
         self.lenght = str(len(self.html))
+        self.encoded = {}
+        if len(self.html) >= min_size:
+            for encoding in ENCODINGS:
+                data = compress(self.html, encoding, 9)
+                if len(data) < len(self.html):
+                    self.encoded[encoding] = (data, str(len(data)))
     
     def __call__(self, request, response):
         response.headers['Content-Type'] = 'text/html; charset=UTF-8'
+        if self.encoded:
+            response.headers['Vary'] = 'Accept-Encoding'
+            encoding = choose_encoding(request.headers.get('Accept-Encoding'), self.encoded)
+            if encoding is not None:
+                data, length = self.encoded[encoding]
+                response.headers['Content-Encoding'] = encoding
+                response.headers['Content-Length'] = length
+                response.body.append(data)
+                return
         response.headers['Content-Length'] = self.lenght
         response.body.append(self.html)
\ No newline at end of file
@@ -0,0 +1,279 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import struct
+import hashlib
+import ctypes
+import weakref
+import mimetypes
+import threading
+
+from collections import OrderedDict
+from email.utils import formatdate
+
+from pyweb.core.compression import SUFFIXES
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+IN_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+           IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+EVENT = struct.Struct('iIII')
+
+def content_hash(path, blocksize=65536):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        data = file.read(blocksize)
+        while data:
+            digest.update(data)
+            data = file.read(blocksize)
+    return digest.hexdigest()
+
+class Metadata():
+    def __init__(self, path, stat, type=None, etag='weak', cache_control=None, encoding=None):
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
+        self.inode = stat.st_ino
+        self.type = mimetypes.guess_type(path)[0] if type is None else type
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        if etag == 'strong':
+            self.etag = '"{}"'.format(content_hash(path))
+        elif etag:
+            self.etag = 'W/"{:x}-{:x}-{:x}"'.format(self.inode, self.size, self.mtime)
+        else:
+            self.etag = None
+        if callable(cache_control):
+            cache_control = cache_control(path)
+        self.validators = [('Last-Modified', self.last_modified)]
+        if self.etag:
+            self.validators.append(('ETag', self.etag))
+        if cache_control:
+            self.validators.append(('Cache-Control', cache_control))
+        self.encoding = encoding
+        self.headers = []
+        if self.type:
+            self.headers.append(('Content-Type', self.type))
+        if self.encoding:
+            self.headers.append(('Content-Encoding', self.encoding))
+        self.headers.append(('Accept-Ranges', 'bytes'))
+        self.headers.extend(self.validators)
+        self.variants = {}
+        self.watched = False
+        self.watches = ()
+    
+    @classmethod
+    def load(cls, path, type=None, etag='weak', cache_control=None):
+        return cls(path, os.stat(path), type, etag, cache_control)
+    
+    def changed(self, stat):
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino) != (self.mtime, self.size, self.inode)
+
+class Inotify():
+    def __init__(self, callback):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._rm_watch = libc.inotify_rm_watch
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.callback = callback
+        self.directories = {}
+        self.watches = {}
+        threading.Thread(target=self.run, daemon=True).start()
+    
+    def watch(self, directory):
+        if directory in self.watches:
+            return True
+        wd = self._add_watch(self.fd, os.fsencode(directory), IN_MASK)
+        if wd < 0:
+            return False
+        self.watches[directory] = wd
+        self.directories[wd] = directory
+        return True
+    
+    def unwatch(self, directory):
+        wd = self.watches.pop(directory, None)
+        if wd is not None:
+            del self.directories[wd]
+            self._rm_watch(self.fd, wd)
+    
+    def run(self):
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                directory = self.directories.get(wd)
+                if mask & IN_Q_OVERFLOW:
+                    self.callback(None, True)
+                elif directory is None:
+                    continue
+                elif mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    del self.directories[wd]
+                    self.watches.pop(directory, None)
+                    self.callback(directory, True)
+                else:
+                    self.callback(os.path.join(directory, name), bool(mask & IN_ISDIR))
+    
+    def close(self):
+        os.close(self.fd)
+
+class MetadataCache():
+    def __init__(self, size=1024, inotify=True, root=None):
+        self.size = size
+        self.inotify = inotify
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        self._watcher = None
+        self._watched = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        reference = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: reference() and reference().reset())
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, key, load):
+        with self._lock:
+            metadata = self._entries.get(key)
+            if metadata is not None:
+                self._entries.move_to_end(key)
+        if metadata is not None and self.valid(metadata):
+            self.hits += 1
+            return metadata
+        self.misses += 1
+        metadata = load(key)
+        if metadata is not None:
+            self.put(key, metadata)
+        return metadata
+    
+    def valid(self, metadata):
+        if metadata.watched:
+            return True
+        try:
+            return not any(entry.changed(os.stat(entry.path))
+                           for entry in [metadata] + list(metadata.variants.values()))
+        except OSError:
+            return False
+    
+    def directories(self, path):
+        directory = os.path.dirname(path)
+        directories = [directory]
+        if self.root is not None and directory.startswith(self.root + os.sep):
+            while directory != self.root:
+                directory = os.path.dirname(directory)
+                directories.append(directory)
+        return directories
+    
+    def put(self, key, metadata):
+        watcher = self.watcher()
+        if watcher is not None and self.watch(metadata):
+            try:
+                changed = metadata.changed(os.stat(metadata.path))
+            except OSError:
+                changed = True
+            if changed:
+                with self._lock:
+                    self.unwatch(metadata)
+                return
+            metadata.watched = True
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None and previous is not metadata:
+                self.unwatch(previous)
+            self._entries[key] = metadata
+            while len(self._entries) > self.size:
+                self.unwatch(self._entries.popitem(last=False)[1])
+    
+    def watch(self, metadata):
+        directories = self.directories(metadata.path)
+        with self._lock:
+            for index, directory in enumerate(directories):
+                if not self._watcher.watch(directory):
+                    metadata.watches = directories[:index]
+                    self.unwatch(metadata)
+                    return False
+                self._watched[directory] = self._watched.get(directory, 0) + 1
+            metadata.watches = directories
+        return True
+    
+    def unwatch(self, metadata):
+        for directory in metadata.watches:
+            count = self._watched.get(directory, 0) - 1
+            if count > 0:
+                self._watched[directory] = count
+            elif directory in self._watched:
+                del self._watched[directory]
+                self._watcher.unwatch(directory)
+        metadata.watches = ()
+    
+    def watcher(self):
+        if self._watcher is None and self.inotify:
+            try:
+                self._watcher = Inotify(self.invalidate)
+            except (OSError, AttributeError, TypeError):
+                self.inotify = False
+        return self._watcher
+    
+    def invalidate(self, path=None, tree=False):
+        with self._lock:
+            if path is None:
+                for metadata in self._entries.values():
+                    self.unwatch(metadata)
+                self._entries.clear()
+            elif tree:
+                prefix = path + os.sep
+                for key, metadata in list(self._entries.items()):
+                    if key == path or key.startswith(prefix) or metadata.path.startswith(prefix):
+                        self.unwatch(self._entries.pop(key))
+            else:
+                paths = [path]
+                paths.extend(path[:-len(suffix)] for suffix in SUFFIXES.values() if path.endswith(suffix))
+                for path in paths:
+                    metadata = self._entries.pop(path, None)
+                    if metadata is not None:
+                        self.unwatch(metadata)
+                    parent = os.path.dirname(path)
+                    if parent in self._entries and self._entries[parent].path == path:
+                        self.unwatch(self._entries.pop(parent))
+    
+    def reset(self):
+        self._lock = threading.Lock()
+        self._entries.clear()
+        self._watched.clear()
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
@@ -0,0 +1,104 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from pyweb.core.forms import MultipartParser, UrlencodedParser, form_parser, parse_options_header
+
+BODY = (b'preamble\r\n'
+        b'--XyZ\r\n'
+        b'Content-Disposition: form-data; name="title"\r\n'
+        b'\r\n'
+        b'hello --XyZ world\r\n'
+        b'--XyZ\r\n'
+        b'Content-Disposition: form-data; name="upload"; filename="a \\"b\\".txt"\r\n'
+        b'Content-Type: application/octet-stream\r\n'
+        b'\r\n'
+        b'\r\n--Xy\x00binary\r\n'
+        b'--XyZ--\r\n'
+        b'epilogue')
+
+def parse(body, size):
+    parser = MultipartParser('XyZ')
+    for index in range(0, len(body), size):
+        parser.feed(body[index:index + size])
+    return parser.close()
+
+class MultipartTest(unittest.TestCase):
+    def test_split_everywhere(self):
+        for size in (1, 2, 3, 5, 7, 11, len(BODY)):
+            fields = parse(BODY, size)
+            self.assertEqual(fields['title'], ['hello --XyZ world'])
+            upload, = fields['upload']
+            self.assertEqual(upload.filename, 'a "b".txt')
+            self.assertEqual(upload.content_type, 'application/octet-stream')
+            self.assertEqual(upload.file.read(), b'\r\n--Xy\x00binary')
+    
+    def test_empty_part(self):
+        fields = parse(b'--XyZ\r\nContent-Disposition: form-data; name="empty"\r\n\r\n\r\n--XyZ--', 4)
+        self.assertEqual(fields['empty'], [''])
+    
+    def test_truncated(self):
+        for end in (0, 10, BODY.index(b'world'), BODY.index(b'--XyZ--')):
+            with self.assertRaises(ValueError):
+                parse(BODY[:end], 3)
+    
+    def test_headers_too_large(self):
+        parser = MultipartParser('XyZ', max_header_size=64)
+        with self.assertRaises(ValueError):
+            parser.feed(b'--XyZ\r\nX-Long: ' + b'a' * 128)
+    
+    def test_missing_delimiter(self):
+        with self.assertRaises(ValueError):
+            parse(b'no delimiter in here at all', 4)
+
+class UrlencodedTest(unittest.TestCase):
+    def test_split_everywhere(self):
+        body = b'a=1&b=two+words&a=%C3%A9&empty=&c=%26'
+        for size in (1, 2, 3, len(body)):
+            parser = UrlencodedParser()
+            for index in range(0, len(body), size):
+                parser.feed(body[index:index + size])
+            self.assertEqual(parser.close(), {'a': ['1', 'é'], 'b': ['two words'], 'c': ['&']})
+    
+    def test_too_large(self):
+        parser = UrlencodedParser(max_size=8)
+        parser.feed(b'a=1234')
+        with self.assertRaises(ValueError):
+            parser.feed(b'&b=5678')
+    
+    def test_malformed(self):
+        parser = UrlencodedParser()
+        parser.feed(b'=&&a&%zz=%&b=%FF')
+        self.assertEqual(parser.close(), {'%zz': ['%'], 'b': ['�']})
+
+class FormParserTest(unittest.TestCase):
+    def test_content_types(self):
+        self.assertIsInstance(form_parser('multipart/form-data; boundary="XyZ"'), MultipartParser)
+        self.assertIsInstance(form_parser('application/x-www-form-urlencoded; charset=utf-8'), UrlencodedParser)
+        self.assertIsNone(form_parser('multipart/form-data'))
+        self.assertIsNone(form_parser('text/plain'))
+        self.assertIsNone(form_parser(None))
+    
+    def test_options(self):
+        self.assertEqual(parse_options_header('Form-Data; name="a;b"; filename=x.txt'),
+                         ('form-data', {'name': 'a;b', 'filename': 'x.txt'}))
+
+if __name__ == '__main__':
+    unittest.main()
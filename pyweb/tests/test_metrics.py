@@ -0,0 +1,57 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from pyweb.core.application import Application
+from pyweb.core.server import AsyncServer
+
+class Streaming(Application):
+    __URLS__ = {'/stream' : 'stream'}
+    __METRICS__ = '/metrics'
+    async def stream(self, request, response):
+        async def body():
+            for index in range(3):
+                yield 'chunk {}\n'.format(index).encode('utf-8')
+        response.body = body()
+
+class AsyncMetricsTest(unittest.TestCase):
+    def test_async_body(self):
+        application = Streaming()
+        async def fetch():
+            server = AsyncServer(application, '127.0.0.1', 0)
+            await server.start()
+            port = server.server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /stream HTTP/1.0\r\nHost: test\r\n\r\n')
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            server.server.close()
+            return response
+        response = asyncio.run(fetch())
+        head, _, body = response.partition(b'\r\n\r\n')
+        self.assertTrue(head.startswith(b'HTTP/1.0 200'))
+        self.assertEqual(body, b'chunk 0\nchunk 1\nchunk 2\n')
+        metrics = application.metrics.route('stream')
+        self.assertEqual(metrics.in_flight, 0)
+        self.assertEqual(metrics.bytes_sent, len(body))
+
+if __name__ == '__main__':
+    unittest.main()
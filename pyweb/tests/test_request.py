@@ -0,0 +1,67 @@
+# -*- coding:utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from pyweb.core.application import Application
+from pyweb.core.request import parse_length, parse_chunk_size
+from pyweb.core.server import AsyncServer
+
+class Echo(Application):
+    __URLS__ = {'/echo' : 'echo'}
+    async def echo(self, request, response):
+        async for data in request.stream_async():
+            response.body.append(data)
+
+class LengthTest(unittest.TestCase):
+    def test_parse_length(self):
+        self.assertEqual(parse_length('0'), 0)
+        self.assertEqual(parse_length('1024'), 1024)
+        for value in ('-5', '+5', ' 5', '5 ', '1_0', '0x10', '', '５'):
+            with self.assertRaises(ValueError):
+                parse_length(value)
+    
+    def test_parse_chunk_size(self):
+        self.assertEqual(parse_chunk_size(b'1aF\r\n'), 0x1af)
+        self.assertEqual(parse_chunk_size(b'10 ;name=value\r\n'), 16)
+        for line in (b'-5\r\n', b'+5\r\n', b' 5\r\n', b'1_0\r\n', b'\r\n', b'0x5\r\n'):
+            with self.assertRaises(ValueError):
+                parse_chunk_size(line)
+    
+    def test_server_rejects(self):
+        async def fetch(head):
+            server = AsyncServer(Echo(), '127.0.0.1', 0)
+            await server.start()
+            port = server.server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'POST /echo HTTP/1.1\r\nHost: test\r\n' + head)
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            server.server.close()
+            return response
+        for head in (b'Content-Length: -5\r\n\r\nhello', b'Content-Length: 5, 5\r\n\r\nhello',
+                     b'Transfer-Encoding: chunked\r\n\r\n-5\r\nhello\r\n0\r\n\r\n'):
+            self.assertTrue(asyncio.run(fetch(head)).startswith(b'HTTP/1.1 400'), head)
+        response = asyncio.run(fetch(b'Content-Length: 5\r\nConnection: close\r\n\r\nhello'))
+        self.assertTrue(response.startswith(b'HTTP/1.1 200'))
+        self.assertTrue(response.endswith(b'\r\n\r\nhello'))
+
+if __name__ == '__main__':
+    unittest.main()